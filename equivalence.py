@@ -0,0 +1,570 @@
+"""
+equivalence.py - Check that every rendering path produces identical RTF.
+
+Generates random documents, renders each one with str(document) and with
+every other way this package can produce a document, and reports any
+difference along with how fast each path is compared to str(). Each
+document is also merged with another one, and the merged file is checked
+the same way against str() of the merger. Any exception is a failure.
+
+    python equivalence.py [count] [seed]
+
+Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
+"""
+from datetime import datetime
+import hashlib
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from pyrtf import (
+    CaseStyle, CertificateOfService, Document, FontTable, NewLine, NewPage,
+    NumberedList, Paragraph, RtfInclude, SignatureBlock, StreamingDocument,
+    TextRun
+)
+from mdimport import read_markdown
+from merge import DocumentMerger
+from table import Table
+import writer
+
+CREATE_TIME = datetime(2019, 11, 1, 9, 30)
+WORDS = [
+    'request', 'produce', 'all', 'documents', 'Respondent', 'Petitioner',
+    '__bank__', '_statements_', '[[tax]]', 'returns,', 'for', 'the',
+    'period.', '[NOTE: see', 'below]', '\\n', 'January', '2019',
+]
+# Bodies of RTF files for RtfInclude, as a word processor might save them.
+INCLUDES = [
+    '{\\rtf1\\ansi\\deff0{\\fonttbl{\\f0 Calibri;}{\\f1 Arial;}}\n'
+    '{\\colortbl;\\red255\\green0\\blue0;}\n'
+    '{\\*\\generator Riched20;}\\viewkind4\\uc1\n'
+    '\\pard\\sa200\\sl276\\slmult1\\f0\\fs22\\lang9 Hello \\b world\\b0\\par\n'
+    '\\pard\\f1\\cf1 Caf\u00e9 \\{braces\\}\\par\n}\n',
+    '{\\rtf1\\ansi\\pard Prior filing text.\\par}',
+    # Word: tables, unnamed groups such as {\\mmathPr ...}, page and
+    # section settings, and a footer, all of which must be left out.
+    '{\\rtf1\\adeflang1025\\ansi\\ansicpg1252\\uc1\\adeff31507\\deff0'
+    '\\stshfdbch31506\\stshfloch31506\\deflang1033\\themelang1033\n'
+    '{\\fonttbl{\\f0\\fbidi \\froman\\fcharset0\\fprq2'
+    '{\\*\\panose 02020603050405020304}Times New Roman;}'
+    '{\\f1\\fbidi \\fswiss\\fcharset0\\fprq2 Calibri;}}\n'
+    '{\\colortbl;\\red0\\green0\\blue0;\\red255\\green0\\blue0;}\n'
+    '{\\*\\defchp \\fs22\\loch\\af31506}{\\*\\defpap \\ql \\li0\\ri0\\sa160}\n'
+    '{\\stylesheet{\\ql \\li0\\ri0\\sa160 \\f1\\fs22 \\snext0 Normal;}}\n'
+    '{\\*\\rsidtbl \\rsid1577\\rsid9261}'
+    '{\\mmathPr\\mmathFont34\\mbrkBin0\\msmallFrac0\\mdispDef1}\n'
+    '{\\info{\\author X}{\\operator X}'
+    '{\\creatim\\yr2019\\mo1\\dy1\\hr9\\min30}}\n'
+    '{\\*\\xmlnstbl {\\xmlns1 http://schemas.microsoft.com/office/word/2003/wordml}}\n'  # NOQA
+    '\\paperw12240\\paperh15840\\margl1440\\margr1440\\margt1440\\margb1440'
+    '\\gutter0\\ltrsect \n'
+    '\\widowctrl\\ftnbj\\aenddoc\\trackmoves0\\donotembedsysfont1\n'
+    '{\\*\\wgrffmtfilter 2450}\\nofeaturethrottle1\\ilfomacatclnup0\n'
+    '\\ltrpar \\sectd \\ltrsect\\linex0\\endnhere\\sectlinegrid360\\sftnbj \n'
+    '{\\footerr \\ltrpar \\pard\\plain OLD FOOTER\\par}\n'
+    '{\\*\\pnseclvl1\\pnucrm\\pnstart1\\pnindent720\\pnhang {\\pntxta .}}\n'
+    '\\pard\\plain \\ltrpar\\ql \\li0\\ri0\\sa160\\sl259\\slmult1 '
+    '\\rtlch\\fcs1 '
+    '\\af31507\\afs22 \\ltrch\\fcs0 \\f1\\fs22 Body text \\b bold\\b0\\par\n'
+    '{\\*\\themedata 0123}\n'
+    '}\n',
+]
+
+
+def random_text(rng: random.Random, words: int = 12) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, words)))
+
+
+def random_properties(rng: random.Random) -> TextRun.Properties:
+    return TextRun.Properties(
+        color=rng.choice([False, False, 1, 2]),
+        bold=rng.random() < 0.3,
+        italic=rng.random() < 0.3,
+        underline=rng.choice([False, False, TextRun.UNDERLINE_SINGLE,
+                              TextRun.UNDERLINE_DOUBLE]),
+        all_caps=rng.random() < 0.2,
+        small_caps=rng.random() < 0.2,
+        strike=rng.random() < 0.1,
+        outline=rng.random() < 0.1,
+    )
+
+
+def random_paragraph(rng: random.Random) -> Paragraph:
+    paragraph = Paragraph(alignment=rng.choice('lrcj'))
+    if rng.random() < 0.2:
+        paragraph.set_header()
+    paragraph.double_space = rng.random() < 0.2
+    if rng.random() < 0.1:
+        paragraph.left_indent = rng.choice([0.5, 1.0])
+        paragraph.right_indent = rng.choice([0, 0.5, 1.0])
+    for _ in range(rng.randint(1, 5)):
+        if rng.random() < 0.1:
+            paragraph.add_text(NewLine())
+        else:
+            paragraph.add_text(
+                TextRun(random_text(rng), random_properties(rng))
+            )
+    return paragraph
+
+
+def random_table(rng: random.Random) -> Table:
+    count = rng.randint(1, 5)
+    kind = rng.choice(['percent', 'fraction', 'twips', 'twips_str'])
+    use_dicts = rng.random() < 0.5
+    with_headers = rng.random() < 0.5
+    columns = []
+    for c in range(count):
+        if kind == 'percent':
+            width = '{}%'.format(rng.randint(10, 90))
+        elif kind == 'fraction':
+            width = rng.choice([0.1, 0.2, 0.25, 0.5, 0.75])
+        elif kind == 'twips':
+            width = rng.randint(500, 4000)
+        else:
+            width = str(rng.randint(500, 4000))
+        columns.append(Table.Column(
+            width=width,
+            borders=''.join(b for b in 'lrtb' if rng.random() < 0.3),
+            alignment=rng.choice([None, 'l', 'r', 'c', 'j']),
+            property='col{}'.format(c) if use_dicts else c,
+            header=random_text(rng, 3) if with_headers else None,
+            hfont=rng.choice([None, 0, 1]),
+            dfont=rng.choice([None, 0, 1]),
+            hcolor=rng.choice([1, 2]),
+            dcolor=rng.choice([None, 1, 2]),
+        ))
+    rows = []
+    for _ in range(rng.randint(0, 30)):
+        values = [random_text(rng, 4) for _ in range(count)]
+        if use_dicts:
+            rows.append({'col{}'.format(c): v for c, v in enumerate(values)})
+        else:
+            rows.append(values)
+    return Table(
+        columns if count > 1 or rng.random() < 0.5 else columns[0],
+        rows,
+        lmargin=rng.choice([0, 0, 720])
+    )
+
+
+def random_case_style(rng: random.Random) -> CaseStyle:
+    return CaseStyle(CaseStyle.CaseInfo(
+        cause_number='{}-{}-2019'.format(rng.randint(1, 999),
+                                         rng.randint(10000, 99999)),
+        county=rng.choice(['Collin', 'Dallas', 'Denton']),
+        court_type=rng.choice(['District', 'County']),
+        court_number=str(rng.randint(1, 500)),
+        petitioner_name='John Doe',
+        respondent_name='Jane Doe',
+        is_divorce=rng.random() < 0.5,
+        child_names=rng.choice([[], ['Johnny Doe'], ['Johnny', 'Julie']]),
+        sensitive=rng.random() < 0.3,
+        doc_title=random_text(rng, 5),
+    ))
+
+
+def random_contents(
+    rng: random.Random,
+    sections: int,
+    includes: list = None
+) -> list:
+    """
+    Produce a random list of content sections.
+
+    Args:
+        rng (random.Random): Source of randomness.
+        sections (int): Number of sections.
+        includes (list): Paths of RTF files that may be included.
+    """
+    attorney = SignatureBlock.Attorney(
+        'Thomas J. Daley', '24059643', 'Power Daley PLLC',
+        '825 Watters Creek Blvd Ste 395', 'Allen, TX 75013',
+        '972-985-4448', '972-985-4449', 'admin@powerdaley.com',
+        'Attorney for Respondent'
+    )
+    contents = [random_case_style(rng)]
+    lists = []
+    for _ in range(sections):
+        kind = rng.random()
+        if kind < 0.6:
+            contents.append(random_paragraph(rng))
+        elif kind < 0.75:
+            contents.append(random_table(rng))
+        elif kind < 0.85:
+            previous = rng.choice(lists) if lists and rng.random() < 0.5 else None  # NOQA
+            numbered = NumberedList(
+                rng.choice(['{}.', 'REQUEST NO. {}:', '({})']),
+                start=rng.randint(1, 5),
+                continues=previous
+            )
+            for _ in range(rng.randint(1, 5)):
+                numbered.add_item(random_text(rng))
+            lists.append(numbered)
+            contents.append(numbered)
+        elif kind < 0.9:
+            contents.append(NewPage())
+        elif kind < 0.93:
+            contents.append(str(random_paragraph(rng)))
+        elif kind < 0.95 and includes:
+            contents.append(RtfInclude(rng.choice(includes)))
+        else:
+            contents.append(SignatureBlock(attorney))
+    certificate = CertificateOfService(attorney.name, attorney.role)
+    certificate.add_recipient(CertificateOfService.Recipient(
+        'Nicholas Nuspl', 'Attorney for Petitioner',
+        'electronic service', 'nick@nuspl.com'
+    ))
+    contents.append(certificate)
+    return contents
+
+
+def setup_document(document: Document):
+    document.color_table.add_color((255, 0, 0))
+    document.color_table.add_color((0, 0, 255))
+
+
+def build_document(
+    seed: int,
+    sections: int,
+    includes: list = None
+) -> Document:
+    document = Document('Title %s' % seed, '469-%s' % seed, 'Case %s' % seed,
+                        create_time=CREATE_TIME)
+    setup_document(document)
+    for content in random_contents(random.Random(seed), sections, includes):
+        document.add_content(content)
+    return document
+
+
+def build_merger(
+    document: Document,
+    seed: int,
+    sections: int,
+    includes: list = None
+) -> DocumentMerger:
+    """
+    Merge *document* with a second one whose fonts, colors and lists are
+    numbered differently, so that the merge has to renumber them.
+    """
+    other = build_document(seed, sections, includes)
+    other.font_table = FontTable(['Calibri', 'Arial', 'Times New Roman'])
+    other.color_table.colors.reverse()
+    other.color_table.add_color((0, 128, 0))
+    return DocumentMerger([document, other], title='Merged',
+                          create_time=CREATE_TIME)
+
+
+# Each path takes the document built by build_document() and returns its
+# RTF as bytes.
+
+def path_str(document):
+    return str(document).encode('utf-8')
+
+
+def path_segments(document):
+    return ''.join(document.segments()).encode('utf-8')
+
+
+def path_parallel_threads(document):
+    return document.render(parallel=4, threshold=0, use_processes=False).encode('utf-8')  # NOQA
+
+
+def path_parallel_processes(document):
+    return document.render(parallel=2, threshold=0).encode('utf-8')
+
+
+def path_writev(document):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'doc.rtf')
+        writer.write_document(document, path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def path_body(document):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'doc.rtf')
+        writer.write_with_body(document, writer.render_body(document), path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def path_indexed(document):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'doc.rtf')
+        writer.write_document(document, path, index_path=path + '.idx')
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def stream(document: Document, output):
+    """
+    Write the same content as *document* through a StreamingDocument.
+    """
+    with StreamingDocument(output, document.title, document.cause_number,
+                           document.case_name, CREATE_TIME) as streaming:
+        setup_document(streaming)
+        # The list table is part of the header, so lists must be known
+        # before anything is written.
+        for content in document.content_sections:
+            if isinstance(content, NumberedList):
+                streaming.list_table.add_list(content)
+        for content in document.content_sections:
+            streaming.add_content(content)
+
+
+def path_streaming_text(document):
+    output = io.StringIO()
+    stream(document, output)
+    return output.getvalue().encode('utf-8')
+
+
+def path_streaming_writev(document):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'doc.rtf')
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+        try:
+            with writer.SegmentWriter(fd) as output:
+                stream(document, output)
+        finally:
+            os.close(fd)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+PATHS = [
+    ('str', path_str),
+    ('segments', path_segments),
+    ('parallel-threads', path_parallel_threads),
+    ('parallel-processes', path_parallel_processes),
+    ('writev', path_writev),
+    ('indexed', path_indexed),
+    ('header+body', path_body),
+    ('streaming-text', path_streaming_text),
+    ('streaming-writev', path_streaming_writev),
+]
+
+
+# Each merge path takes the merger built by build_merger() and returns the
+# merged RTF as bytes.
+
+def merge_str(merger):
+    return str(merger).encode('utf-8')
+
+
+def merge_writev(merger):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'merged.rtf')
+        writer.write_document(merger, path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def merge_buffer(merger):
+    sink = writer.BufferSink()
+    sink.write_segments(merger.segments(raw=True))
+    return b''.join(sink.buffers)
+
+
+MERGE_PATHS = [
+    ('merge-str', merge_str),
+    ('merge-writev', merge_writev),
+    ('merge-buffer', merge_buffer),
+]
+
+
+def run_path(fn, document):
+    """
+    Run one path, returning its output (or the exception it raised) and
+    how long it took.
+    """
+    start = time.perf_counter()
+    try:
+        result = fn(document)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+def run_paths(paths: list, target, doc_seed: int, timings: dict) -> list:
+    """
+    Run every path on *target* and compare each output with the first
+    path's.
+
+    Returns:
+        (list): (seed, path name, problem) for each path that raised an
+            exception or produced different output.
+    """
+    failures = []
+    outputs = {}
+    for name, fn in paths:
+        result, elapsed = run_path(fn, target)
+        timings[name] += elapsed
+        if isinstance(result, Exception):
+            failures.append((doc_seed, name, repr(result)))
+        else:
+            outputs[name] = result
+    reference_name = paths[0][0]
+    if reference_name in outputs:
+        reference = outputs[reference_name]
+        for name, result in outputs.items():
+            if result != reference:
+                failures.append((doc_seed, name, 'output differs'))
+    return failures
+
+
+def check(count: int = 50, seed: int = 0, sections: int = 200) -> list:
+    """
+    Render *count* random documents, and a merge of each with another
+    random document, through every path.
+
+    A path passes if it produces the same bytes as str() of the document
+    (or merger). Any exception, including one from str(), is a failure.
+
+    Returns:
+        (list): (seed, path name, problem) for each failure.
+    """
+    failures = []
+    timings = {name: 0.0 for name, _ in PATHS + MERGE_PATHS}
+    with tempfile.TemporaryDirectory() as tmp:
+        includes = []
+        for i, rtf in enumerate(INCLUDES):
+            includes.append(os.path.join(tmp, 'include%s.rtf' % i))
+            with open(includes[-1], 'w', encoding='utf-8') as f:
+                f.write(rtf)
+
+        for doc_seed in range(seed, seed + count):
+            try:
+                document = build_document(doc_seed, sections, includes)
+                merger = build_merger(
+                    document, doc_seed + 100000, sections // 4, includes
+                )
+            except Exception as e:
+                failures.append((doc_seed, 'build', repr(e)))
+                continue
+            failures += run_paths(PATHS, document, doc_seed, timings)
+            failures += run_paths(MERGE_PATHS, merger, doc_seed, timings)
+            try:
+                reference = path_str(document)
+                digest = writer.document_hash(document)
+                if digest != hashlib.sha256(reference).hexdigest():
+                    failures.append((doc_seed, 'hash', 'digest differs'))
+            except Exception as e:
+                failures.append((doc_seed, 'hash', repr(e)))
+
+    print('{:<20} {:>10} {:>8}'.format('path', 'seconds', 'speedup'))
+    for paths in (PATHS, MERGE_PATHS):
+        reference_name = paths[0][0]
+        for name, _ in paths:
+            print('{:<20} {:>10.3f} {:>7.2f}x'.format(
+                name, timings[name],
+                timings[reference_name] / (timings[name] or 1e-9)
+            ))
+    for doc_seed, name, problem in failures:
+        print('FAILED: seed {} path {}: {}'.format(doc_seed, name, problem))
+    return failures
+
+
+# An escaped backslash or brace, a group, \\plain, or a font reference.
+FONT_STATE = re.compile(r'\\\\[\\{}]|[{}]|\\plain|\\f(\d+)')
+
+
+def font_at(rtf: str, position: int) -> int:
+    """
+    Work out which font number is in effect at *position* in an RTF
+    document whose default font is 0.
+    """
+    fonts = [0]
+    for match in FONT_STATE.finditer(rtf, 0, position):
+        token = match.group(0)
+        if token == '{':
+            fonts.append(fonts[-1])
+        elif token == '}':
+            fonts.pop()
+        elif token == '\\plain':
+            fonts[-1] = 0
+        elif match.group(1) is not None:
+            fonts[-1] = int(match.group(1))
+    return fonts[-1]
+
+
+def check_merge_fonts() -> list:
+    """
+    Merge documents with different font tables and check that each one's
+    text is still in its own default font.
+
+    Returns:
+        (list): (document number, expected font, actual font) for each
+            document whose text is in the wrong font.
+    """
+    font_lists = [
+        ['Times New Roman', 'Calibri'],
+        ['Calibri', 'Arial'],
+        ['Arial'],
+        ['Times New Roman', 'Calibri'],
+    ]
+    merger = DocumentMerger(create_time=CREATE_TIME)
+    for i, fonts in enumerate(font_lists):
+        document = Document('Merge %s' % i, '', 'Case %s' % i,
+                            create_time=CREATE_TIME)
+        document.font_table = FontTable(fonts)
+        paragraph = Paragraph()
+        paragraph.add_text(TextRun('MARKER%s' % i))
+        document.add_content(paragraph)
+        merger.add_document(document)
+
+    rtf = str(merger)
+    failures = []
+    for i, fonts in enumerate(font_lists):
+        actual = merger.font_table.fonts[font_at(rtf, rtf.index('MARKER%s' % i))]  # NOQA
+        if actual != fonts[0]:
+            failures.append((i, fonts[0], actual))
+            print('MERGE FONT: document {} is in {}, not {}'.format(
+                i, actual, fonts[0]
+            ))
+    return failures
+
+
+def check_markdown_timing(lines: int = 2000) -> list:
+    """
+    Check that importing Markdown takes linear time, even for a paragraph
+    full of emphasis markers that are never closed. Quadrupling the length
+    of such a paragraph should take about four times as long, not sixteen.
+
+    Returns:
+        (list): (line, ratio) for each kind of line that scaled badly.
+    """
+    failures = []
+    for line in ['word *x ', 'word _x ', 'word **x ', 'word __x ']:
+        times = []
+        for count in (lines, lines * 4):
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                for content in read_markdown([line] * count):
+                    str(content)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times.append(best)
+        ratio = times[1] / times[0]
+        if ratio > 8:
+            failures.append((line, ratio))
+            print('MARKDOWN TIMING: {!r} took {:.1f}x as long for 4x the '
+                  'lines'.format(line, ratio))
+    return failures
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    failures = check(count, seed) + check_merge_fonts()
+    failures += check_markdown_timing()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+mdimport.py - Stream Markdown text into pyrtf content elements.
+
+Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
+"""
+import re
+
+from pyrtf import NewLine, NewPage, Paragraph, TextRun, escape
+
+HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+NUMBERED = re.compile(r'^\s{0,3}(\d+)[.)]\s+(.*)$')
+QUOTE = re.compile(r'^\s{0,3}>\s?(.*)$')
+PAGE_BREAK = re.compile(r'^\s{0,3}([-*_])(\s*\1){2,}\s*$')
+# The emphasized text can't contain its own delimiter, so an unmatched
+# delimiter is only scanned as far as the next one, keeping the scan of a
+# paragraph linear.
+EMPHASIS = re.compile(
+    r'\*\*(?=\S)([^*]+?)(?<=\S)\*\*'  # Bold
+    r'|__(?=\S)([^_]+?)(?<=\S)__'  # Bold
+    r'|\*(?=\S)([^*]+?)(?<=\S)\*'  # Italic
+    r'|(?<!\w)_(?=\S)([^_]+?)(?<=\S)_(?!\w)'  # Italic
+)
+
+
+class MarkdownReader(object):
+    """
+    Converts block-level Markdown into Paragraph and NewPage objects.
+
+    Input is read one line at a time and each block is yielded as soon as
+    it ends, so only the current paragraph is ever held in memory.
+
+    Supported Markdown:
+        # Heading            Centered, bold, all-caps heading.
+        ## Sub-heading       Left-aligned, bold heading (levels 2 to 6).
+        1. Numbered item     Numbered request or response.
+        > Quoted text        Indented block quote.
+        ---                  Page break (also *** and ___).
+        **bold**, __bold__   Bold text.
+        *italic*, _italic_   Italic text.
+        Two trailing spaces or a trailing backslash force a line break.
+    """
+    def __init__(
+        self,
+        number_format: str = '{}.',
+        quote_indent: float = 1.0
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            number_format (str): Format for the label of a numbered item,
+                e.g. 'REQUEST NO. {}:'. The number from the Markdown is
+                substituted for {}.
+            quote_indent (float): Left and right indent, in inches, for
+                block quotes.
+        """
+        self.number_format = number_format
+        self.quote_indent = quote_indent
+
+    def read(self, lines):
+        """
+        Yield content elements for an iterable of Markdown lines, e.g. an
+        open file.
+        """
+        kind = None  # 'text', 'quote' or 'item'
+        label = None
+        pieces = []
+
+        for line in lines:
+            line = line.rstrip('\r\n')
+            hard_break = line.endswith('  ') or line.endswith('\\')
+            if line.endswith('\\'):
+                line = line[:-1]
+            stripped = line.strip()
+
+            if not stripped:
+                if kind:
+                    yield self.block(kind, label, pieces)
+                kind = None
+                continue
+
+            if PAGE_BREAK.match(line):
+                if kind:
+                    yield self.block(kind, label, pieces)
+                kind = None
+                yield NewPage()
+                continue
+
+            match = HEADING.match(line)
+            if match:
+                if kind:
+                    yield self.block(kind, label, pieces)
+                kind = None
+                yield self.heading(len(match.group(1)), match.group(2))
+                continue
+
+            match = NUMBERED.match(line)
+            if match:
+                if kind:
+                    yield self.block(kind, label, pieces)
+                kind = 'item'
+                label = match.group(1)
+                pieces = []
+                stripped = match.group(2).strip()
+            else:
+                match = QUOTE.match(line)
+                if match:
+                    if kind != 'quote':
+                        if kind:
+                            yield self.block(kind, label, pieces)
+                        kind = 'quote'
+                        pieces = []
+                    stripped = match.group(1).strip()
+                elif not kind:
+                    kind = 'text'
+                    pieces = []
+
+            # A line that isn't blank and doesn't start a new block
+            # continues the current one.
+            if stripped:
+                pieces.append(stripped)
+            if hard_break:
+                pieces.append(None)
+
+        if kind:
+            yield self.block(kind, label, pieces)
+
+    def heading(self, level: int, text: str) -> Paragraph:
+        if level == 1:
+            paragraph = Paragraph(alignment=Paragraph.ALIGN_CENTER)
+            props = TextRun.Properties(bold=True, all_caps=True)
+        else:
+            paragraph = Paragraph(alignment=Paragraph.ALIGN_LEFT)
+            props = TextRun.Properties(bold=True)
+        paragraph.set_header()
+        for run in self.runs(text, props):
+            paragraph.add_text(run)
+        return paragraph
+
+    def block(self, kind: str, label: str, pieces: list) -> Paragraph:
+        """
+        Build a Paragraph from the lines of one block. None in *pieces*
+        marks a forced line break.
+        """
+        paragraph = Paragraph()
+        if kind == 'quote':
+            paragraph.indent_first_line = False
+            paragraph.left_indent = self.quote_indent
+            paragraph.right_indent = self.quote_indent
+        elif kind == 'item':
+            paragraph.add_text(TextRun(
+                escape(self.number_format.format(label)) + ' ',
+                TextRun.Properties(bold=True),
+                markdown=False
+            ))
+
+        text = []
+        for piece in pieces:
+            if piece is None:
+                for run in self.runs(' '.join(text)):
+                    paragraph.add_text(run)
+                paragraph.add_text(NewLine())
+                text = []
+            else:
+                text.append(piece)
+        if text:
+            for run in self.runs(' '.join(text)):
+                paragraph.add_text(run)
+        return paragraph
+
+    def runs(self, text: str, props: TextRun.Properties = None):
+        """
+        Yield TextRuns for a line of text, splitting it at emphasis markers.
+        """
+        props = props or TextRun.Properties()
+        position = 0
+        for match in EMPHASIS.finditer(text):
+            if match.start() > position:
+                yield self.run(text[position:match.start()], props)
+            bold = match.group(1) or match.group(2)
+            if bold:
+                yield self.run(bold, props._replace(bold=True))
+            else:
+                italic = match.group(3) or match.group(4)
+                yield self.run(italic, props._replace(italic=True))
+            position = match.end()
+        if position < len(text):
+            yield self.run(text[position:], props)
+
+    def run(self, text: str, props: TextRun.Properties) -> TextRun:
+        return TextRun(escape(text), props, markdown=False)
+
+
+def read_markdown(lines, **kwargs):
+    """
+    Yield content elements for an iterable of Markdown lines.
+
+    Args:
+        lines: Iterable of str, e.g. an open file.
+        kwargs: Passed to MarkdownReader().
+    """
+    return MarkdownReader(**kwargs).read(lines)
+
+
+def import_markdown(document, path: str, encoding: str = 'utf-8', **kwargs):
+    """
+    Add the contents of a Markdown file to a document, or to anything else
+    with an add_content() method.
+
+    Args:
+        document: Receives each content element.
+        path (str): The Markdown file.
+        encoding (str): Encoding of the Markdown file.
+        kwargs: Passed to MarkdownReader().
+    """
+    with open(path, encoding=encoding) as f:
+        for content in read_markdown(f, **kwargs):
+            document.add_content(content)
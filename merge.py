@@ -0,0 +1,200 @@
+"""
+merge.py - Combine several Documents into one RTF file.
+
+Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
+"""
+import copy
+from datetime import datetime
+import re
+
+from pyrtf import (
+    CaseStyle, ColorTable, Document, FontTable, Information, ListTable,
+    section_segments
+)
+
+# An escaped backslash, or a font (\fN), color (\cfN) or list (\lsN)
+# reference.
+CONTROL_NUMBER = re.compile(r'\\\\|\\(c?f|ls)(\d+)')
+
+
+class DocumentMerger(object):
+    """
+    Combines Documents into a single RTF file with one section (\\sect) per
+    document. Each section keeps its document's Footer.
+
+    The documents' font, color and list tables are merged into one
+    FontTable, ColorTable and ListTable. While each document is rendered,
+    its \\fN, \\cfN and \\lsN references are renumbered to match the merged
+    tables. Documents whose numbering already matches are passed through
+    untouched.
+
+    Document properties belong to the whole file, so they can't hold a
+    different value for each section. Footers and case styles that show
+    properties as Fields (use_fields=True) are written as plain text
+    instead.
+    """
+    def __init__(
+        self,
+        documents: list = None,
+        title: str = '',
+        create_time: datetime = None
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            documents (list): Documents to merge, in order.
+            title (str): Title for the merged file's information block.
+            create_time (datetime): As for Information.
+        """
+        self.documents = []
+        self.font_table = FontTable([])
+        self.color_table = ColorTable()
+        self.list_table = ListTable()
+        self.docinfo = Information(title=title, create_time=create_time)
+        for document in documents or []:
+            self.add_document(document)
+
+    def add_document(self, document: Document):
+        self.documents.append(document)
+
+    def build_tables(self) -> list:
+        """
+        Build the merged font, color and list tables.
+
+        Returns:
+            (list): For each document, a dict with the keys 'f', 'cf' and
+                'ls', each mapping the document's font, color or list
+                numbers to the merged numbers. Numbers that don't change
+                are left out.
+        """
+        self.font_table = FontTable([])
+        self.color_table = ColorTable()
+        self.list_table = ListTable()
+        fonts = {}
+        colors = {}
+        maps = []
+        for document in self.documents:
+            font_map = {}
+            for i, font_name in enumerate(document.font_table.fonts):
+                if font_name not in fonts:
+                    fonts[font_name] = len(self.font_table.fonts)
+                    self.font_table.fonts.append(font_name)
+                if fonts[font_name] != i:
+                    font_map[i] = fonts[font_name]
+
+            # Color 0 is the automatic color, so numbering starts at 1.
+            color_map = {}
+            for i, color in enumerate(document.color_table.colors, 1):
+                if color not in colors:
+                    self.color_table.add_color(color)
+                    colors[color] = len(self.color_table.colors)
+                if colors[color] != i:
+                    color_map[i] = colors[color]
+
+            # Lists are never shared between documents.
+            list_map = {}
+            for i, definition in enumerate(document.list_table.definitions, 1):  # NOQA
+                self.list_table.definitions.append(definition)
+                if len(self.list_table.definitions) != i:
+                    list_map[i] = len(self.list_table.definitions)
+            maps.append({'f': font_map, 'cf': color_map, 'ls': list_map})
+        return maps
+
+    def segments(self, raw: bool = False):
+        """
+        Yield the merged document as a sequence of RTF fragments.
+
+        Only one document's fragments are produced at a time, so the merged
+        output never has to be held in memory.
+
+        Args:
+            raw (bool): As for Document.segments(). Only documents whose
+                numbering is unchanged yield bytes-like fragments. The
+                others are rendered as text, so that included RTF (see
+                RtfInclude) is renumbered too.
+        """
+        maps = self.build_tables()
+        first = self.documents[0] if self.documents else Document()
+        yield '{'
+        yield str(first.header)
+        yield str(self.font_table)
+        yield str(self.color_table)
+        yield str(self.list_table)
+        yield str(self.docinfo)
+        yield str(first.paper_dimensions)
+        yield str(first.magins)
+        yield str(first.tabs)
+
+        for i, document in enumerate(self.documents):
+            yield '\\sect\\sectd\n' if i else '\\sectd\n'
+            if any(maps[i].values()):
+                for fragment in document_body_segments(document):
+                    yield remap(fragment, maps[i])
+            else:
+                yield from document_body_segments(document, raw)
+        yield '}'
+
+    def __str__(self):
+        return ''.join(self.segments())
+
+
+def document_body_segments(document: Document, raw: bool = False):
+    """
+    Yield the parts of a document that belong in its own section.
+
+    The merged header's \\deff0 is the first document's default font, so
+    the document's own font 0 is selected explicitly, both at the start of
+    the section and after the \\plain in the preliminaries. Like every
+    other \\fN, it is renumbered by remap().
+    """
+    yield '\\f0\\fs{}\n'.format(document.font_size * 2)
+    yield str(without_fields(document.footer))
+    yield str(document.preliminaries)
+    yield '\\f0 '
+    for section in document.content_sections:
+        if isinstance(section, CaseStyle):
+            section = without_fields(section)
+        yield from section_segments(section, raw)
+
+
+def without_fields(element):
+    """
+    Return a Footer or CaseStyle that shows its values as text, copying it
+    if it uses Fields.
+    """
+    if not element.use_fields:
+        return element
+    element = copy.copy(element)
+    element.use_fields = False
+    return element
+
+
+def remap(fragment, maps: dict):
+    """
+    Renumber the \\fN, \\cfN and \\lsN references in an RTF fragment.
+
+    Args:
+        fragment: RTF text.
+        maps (dict): For each of 'f', 'cf' and 'ls', a dict of old number
+            -> new number.
+
+    Returns:
+        The fragment with its references renumbered. Numbers that aren't in
+        the maps are left alone.
+    """
+    if not isinstance(fragment, str) or (
+        '\\f' not in fragment and
+        '\\cf' not in fragment and
+        '\\ls' not in fragment
+    ):
+        return fragment
+
+    def replace(match):
+        word = match.group(1)
+        if word is None:
+            return match.group(0)
+        number = int(match.group(2))
+        return '\\{}{}'.format(word, maps[word].get(number, number))
+
+    return CONTROL_NUMBER.sub(replace, fragment)
@@ -4,7 +4,11 @@ pyrtf.py - Classes for creating simple RTF documents.
 Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
 """
 from collections import namedtuple
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+import mmap
+import os
+import re
 import textwrap
 
 from table import Table
@@ -12,6 +16,46 @@ from table import Table
 Color = namedtuple('Color', ['red', 'green', 'blue'])
 
 
+def escape(text: str) -> str:
+    """
+    Escape the characters that have special meaning in RTF, and write
+    characters outside ASCII as \\uN? so they survive in an \\ansi
+    document.
+    """
+    text = text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+    if text.isascii():
+        return text
+    return ''.join(c if c < '\x80' else unicode_escape(c) for c in text)
+
+
+def unicode_escape(char: str) -> str:
+    """
+    Produce the \\uN? control word(s) for one character. N is a signed
+    16-bit number, and characters outside the Basic Multilingual Plane are
+    written as a surrogate pair.
+    """
+    units = char.encode('utf-16-le')
+    words = []
+    for i in range(0, len(units), 2):
+        n = int.from_bytes(units[i:i + 2], 'little')
+        words.append('\\u%d?' % (n - 65536 if n > 32767 else n))
+    return ''.join(words)
+
+
+# An escaped backslash or a control word.
+CONTROL_WORD = re.compile(r'(\\\\|\\[a-zA-Z]+-?\d*)')
+
+
+def upper_text(rtf: str) -> str:
+    """
+    Upper-case the text of an RTF fragment, leaving its control words
+    (e.g. the \\uN? from escape()) alone.
+    """
+    parts = CONTROL_WORD.split(rtf)
+    parts[::2] = [text.upper() for text in parts[::2]]
+    return ''.join(parts)
+
+
 class Prolog(object):
     def __str__(self):
         return '\\rtf1\\ansi\\deff0\n'
@@ -45,18 +89,115 @@ class ColorTable(object):
         return '{\\colortbl;' + ''.join(color_table) + '}\n'
 
 
+class ListTable(object):
+    """
+    The list table and list override table, which define the numbering
+    used by NumberedList. Nothing is written if there are no lists.
+    """
+    ListDefinition = namedtuple(
+        'ListDefinition',
+        ['label_format', 'start', 'bold_label']
+    )
+    ListDefinition.__qualname__ = 'ListTable.ListDefinition'
+
+    def __init__(self):
+        self.definitions = []
+        self.registered = set()
+
+    def add_list(self, numbered_list):
+        """
+        Give a NumberedList its list number (\\lsN).
+
+        A list that continues another list shares its number, so Word
+        carries on counting from where the other list stopped.
+        """
+        if numbered_list.continues is not None:
+            if id(numbered_list.continues) not in self.registered:
+                self.add_list(numbered_list.continues)
+            numbered_list.ls = numbered_list.continues.ls
+        else:
+            self.definitions.append(ListTable.ListDefinition(
+                numbered_list.label_format,
+                numbered_list.start,
+                numbered_list.bold_label
+            ))
+            numbered_list.ls = len(self.definitions)
+        self.registered.add(id(numbered_list))
+
+    def __contains__(self, numbered_list) -> bool:
+        return id(numbered_list) in self.registered
+
+    def level_text(self, label_format: str) -> str:
+        """
+        Produce the \\leveltext and \\levelnumbers groups for a label such
+        as 'REQUEST NO. {}:', where {} is replaced by the number.
+        """
+        prefix, _, suffix = label_format.partition('{}')
+        length = len(prefix) + 1 + len(suffix)
+        if length > 255:
+            raise ValueError("List label format is too long")
+        return (
+            "{\\leveltext\\'%02x%s\\'00%s;}" %
+                (length, escape(prefix), escape(suffix)) +  # NOQA
+            "{\\levelnumbers\\'%02x;}" % (len(prefix) + 1)
+        )
+
+    def __str__(self):
+        if not self.definitions:
+            return ''
+        lists = []
+        overrides = []
+        for ls, definition in enumerate(self.definitions, 1):
+            lists.append(
+                '{\\list\\listsimple{\\listlevel\\levelnfc0\\leveljc0' +
+                '\\levelfollow1\\levelstartat{}'.format(definition.start) +
+                self.level_text(definition.label_format) +
+                ('\\b' if definition.bold_label else '') +
+                '\\fi0\\li0}{\\listname ;}\\listid%d}' % ls
+            )
+            overrides.append(
+                '{\\listoverride\\listid%d\\listoverridecount0\\ls%d}' % (
+                    ls, ls
+                )
+            )
+        return (
+            '{\\*\\listtable' + ''.join(lists) + '}\n' +
+            '{\\*\\listoverridetable' + ''.join(overrides) + '}\n'
+        )
+
+
 class Information(object):
     def __init__(
         self,
         title: str = '',
         author: str = 'discovery.jdbot.us',
-        company: str = 'JDBOT, LLC'
+        company: str = 'JDBOT, LLC',
+        create_time: datetime = None
     ):
+        """
+        Instance initializer.
+
+        Args:
+            title (str): Document title.
+            author (str): Document author.
+            company (str): Author's company.
+            create_time (datetime): Creation time to record. If None, the
+                time given by the SOURCE_DATE_EPOCH environment variable
+                (seconds since 1970, UTC) is used if it is set, otherwise
+                the current time. Fix the time to make rendering repeatable.
+
+        Raises:
+            ValueError: If SOURCE_DATE_EPOCH is needed and is not a
+                non-negative whole number. An empty value counts as unset.
+        """
         self.title = title
         self.author = author
         self.company = company
-        self.create_time = datetime.now()
+        if create_time is None:
+            create_time = source_date_epoch()
+        self.create_time = create_time or datetime.now()
         self.comment = "Created by the Discovery Bot"
+        self.properties = {}  # Custom properties, shown by Fields
 
     def __str__(self):
         return (
@@ -69,9 +210,45 @@ class Information(object):
                  self.create_time.day,
                  self.create_time.hour, self.create_time.minute) +
             '{\\doccomm %s}\n' % self.comment +
-            '}'
+            '}' +
+            self.user_properties()
         )
 
+    def user_properties(self) -> str:
+        """
+        Produce the custom document properties, if there are any.
+        """
+        if not self.properties:
+            return ''
+        props = [
+            '{\\propname %s}\\proptype30{\\staticval %s}' %
+                (escape(name), escape(str(value)))  # NOQA
+            for name, value in self.properties.items()
+        ]
+        return '{\\*\\userprops ' + ''.join(props) + '}\n'
+
+
+def source_date_epoch() -> datetime:
+    """
+    Read the SOURCE_DATE_EPOCH environment variable.
+
+    Returns:
+        (datetime): The time it gives, in UTC, or None if it isn't set.
+
+    Raises:
+        ValueError: If it is set to anything but a non-negative whole
+            number of seconds.
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    if not value:
+        return None
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(
+            "SOURCE_DATE_EPOCH must be a whole number of seconds since "
+            "1970, not %r" % value
+        )
+    return datetime.fromtimestamp(int(value), timezone.utc)
+
 
 class Margins(object):
     def __init__(
@@ -116,16 +293,60 @@ class OtherPreliminaries(object):
         )
 
 
+class Field(object):
+    """
+    A field that shows a custom document property (see
+    Information.properties). The property can then be changed without
+    changing the text around the field.
+
+    Fields are marked dirty so that Word updates them when the document is
+    opened. *result* is what is shown until then.
+    """
+    def __init__(self, name: str, result: str = '', upper: bool = False):
+        """
+        Instance initializer.
+
+        Args:
+            name (str): Name of the custom document property.
+            result (str): Text to show until the field is updated.
+            upper (bool): Show the property's value in upper case.
+        """
+        self.name = name
+        self.result = result
+        self.upper = upper
+
+    def __str__(self):
+        switch = ' \\\\* Upper' if self.upper else ''
+        return (
+            '{\\field\\flddirty{\\*\\fldinst DOCPROPERTY %s%s}' %
+                (self.name, switch) +  # NOQA
+            '{\\fldrslt %s}}' % escape(self.result)
+        )
+
+
 class Footer(object):
     def __init__(
         self,
         case_name: str = "[INSERT CASE NAME]",
         cause_number: str = "[INSERT CAUSE NUMBER]",
-        title: str = "[INSERT DOCUMENT TITLE HERE]"
+        title: str = "[INSERT DOCUMENT TITLE HERE]",
+        use_fields: bool = False
     ):
+        """
+        Instance initializer.
+
+        Args:
+            case_name (str): Case name, shown in upper case.
+            cause_number (str): Cause number.
+            title (str): Document title.
+            use_fields (bool): Show the values as Fields of the CaseName,
+                CauseNumber and Title document properties, rather than as
+                text.
+        """
         self.case_name = case_name
         self.cause_number = cause_number
         self.title = title
+        self.use_fields = use_fields
 
     def __str__(self):
         """
@@ -141,14 +362,22 @@ class Footer(object):
             * Top border (brdrt and brdrs) that is 10 twips thick (brdrw10)
               and separated from the text by 20 twips (brsp20)
         """
+        if self.use_fields:
+            case_name = str(Field('CaseName', self.case_name.upper(), True))
+            cause_number = str(Field('CauseNumber', self.cause_number))
+            title = str(Field('Title', self.title))
+        else:
+            case_name = upper_text(self.case_name)
+            cause_number = self.cause_number
+            title = self.title
         return (
             '{\\footer\\pard\\plain\\ql\\fs22\\b\\tqc\\tx4680\\tqr\\tx9360' +
             '\\f1\\adjustright' +
             '\\brdrt\\brdrs\\brdrw10\\brsp20 ' +
-            self.case_name.upper() +
+            case_name +
             '\\tab\\tab PAGE \\chpgn\\line \n' +
-            'Cause #' + self.cause_number + '\\line \n' +
-            self.title + '\\par}\n'
+            'Cause #' + cause_number + '\\line \n' +
+            title + '\\par}\n'
         )
 
 
@@ -178,9 +407,11 @@ class TextRun(object):
         'outline'
     )
     Properties = namedtuple('Properties', props, defaults=(False,) * len(props))  # NOQA
+    Properties.__qualname__ = 'TextRun.Properties'  # So it can be pickled
 
     # For MD-ish syntax to RTF
     Replacement = namedtuple('Replacement', ['old', 'new'])
+    Replacement.__qualname__ = 'TextRun.Replacement'
     replacements = [
         # Bold
         Replacement(old=' __', new=' \\b '),
@@ -205,10 +436,25 @@ class TextRun(object):
         Replacement(old='[NOTE: ', new='[\\b\\cf2 NOTE\\b0\\cf1 :'),
     ]
 
-    def __init__(self, text: str, props: Properties = None):
+    def __init__(
+        self,
+        text: str,
+        props: Properties = None,
+        markdown: bool = True
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            text (str): Text of the run.
+            props (Properties): Character formatting for the run.
+            markdown (bool): If True, convert the MD-ish markers in *text*
+                (see md2rtf()). If False, *text* is used as-is and must
+                already be valid RTF.
+        """
         myprops = props or TextRun.Properties()
 
-        self.text = self.md2rtf(text)
+        self.text = self.md2rtf(text) if markdown else str(text)
         self.color = myprops.color
         self.bold = myprops.bold
         self.italic = myprops.italic
@@ -282,6 +528,8 @@ class Paragraph(object):
         self.alignment = alignment
         self.is_header = False
         self.indent_first_line = True
+        self.left_indent = 0.0  # Inches
+        self.right_indent = 0.0  # Inches
 
     def set_header(self):
         self.is_header = True
@@ -302,6 +550,10 @@ class Paragraph(object):
             keep = '\\keepn'
         if self.indent_first_line and not self.is_header:
             indent = '\\fi720'  # Indent first line by one-half inch
+        if self.left_indent:
+            indent += '\\li{}'.format(int(self.left_indent * 1440.0))
+        if self.right_indent:
+            indent += '\\ri{}'.format(int(self.right_indent * 1440.0))
         return (
             '{{\\pard{}\\q{} '.format(spacing, self.alignment) +
             keep + indent +
@@ -310,6 +562,203 @@ class Paragraph(object):
         )
 
 
+class NumberedList(object):
+    """
+    A run of paragraphs numbered automatically by the word processor, e.g.
+    "REQUEST NO. 1:", "REQUEST NO. 2:", ...
+
+    The numbering is defined once in the document's ListTable and each item
+    only refers to it, so items carry no formatting runs for their labels.
+    Adding the list to a Document registers it in the document's ListTable.
+    """
+    def __init__(
+        self,
+        label_format: str = '{}.',
+        start: int = 1,
+        bold_label: bool = True,
+        alignment: str = 'j',
+        continues=None
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            label_format (str): Label for each item. {} is replaced by the
+                item number, e.g. 'REQUEST NO. {}:'.
+            start (int): Number of the first item.
+            bold_label (bool): Whether the label is bold.
+            alignment (str): Paragraph alignment, as for Paragraph.
+            continues (NumberedList): An earlier list whose numbering this
+                list continues. label_format, start and bold_label are then
+                taken from that list. Use this to put other paragraphs,
+                such as responses, between numbered items.
+        """
+        self.label_format = label_format
+        self.start = start
+        self.bold_label = bold_label
+        self.alignment = alignment
+        self.continues = continues
+        self.items = []
+        self.ls = None
+
+    def add_item(self, item):
+        """
+        Add a numbered item.
+
+        Args:
+            item: A str (converted with TextRun), a TextRun, or a list of
+                TextRuns and other inline content such as NewLine.
+        """
+        self.items.append(item)
+
+    def segments(self):
+        """
+        Yield the RTF for each item.
+        """
+        if self.ls is None:
+            raise ValueError(
+                "A NumberedList must be added to a Document before rendering"
+            )
+        begin = '{{\\pard\\ls{}\\ilvl0\\q{} '.format(self.ls, self.alignment)
+        for item in self.items:
+            if isinstance(item, str):
+                text = str(TextRun(item))
+            elif isinstance(item, list):
+                text = ''.join(str(t) for t in item)
+            else:
+                text = str(item)
+            yield begin + text + '\\par}\n'
+
+    def __str__(self):
+        return ''.join(self.segments())
+
+
+class RtfInclude(object):
+    """
+    Includes the body of an existing RTF file, e.g. a prior filing or a
+    clause-library fragment.
+
+    The file is memory-mapped when the document is rendered. Its outer
+    {\\rtf1 ...} group and everything before the first body text are
+    stripped by scanning only the header: tables (fonts, colors, styles,
+    info, etc.), other groups such as Word's {\\mmathPr ...}, and
+    document and section settings (paper size, margins, \\sectd and the
+    headers and footers that follow it). The body is put in a group of its
+    own, so that formatting it leaves set (font, size, language, etc.)
+    ends with it. It is passed to writers that accept bytes as a view of
+    the mapped file, without being decoded or copied.
+
+    Font and color numbers in the included body refer to the including
+    document's tables, so use the same fonts and colors in both.
+    """
+    # Control words that start the body of the included file. Any other
+    # control word before them is a document or section setting, and any
+    # group before them is dropped unless it starts with one of these or
+    # with character formatting (BODY_GROUP_WORDS).
+    BODY_WORDS = frozenset([
+        b'pard', b'par', b'sect', b'page', b'trowd', b'line', b'tab',
+    ])
+    BODY_GROUP_WORDS = BODY_WORDS | frozenset([
+        b'plain', b'b', b'i', b'ul', b'f', b'fs', b'cf', b'caps', b'scaps',
+        b'strike', b'field', b'pict', b'shp', b'object',
+    ])
+    CONTROL_WORD = re.compile(rb'\\([a-zA-Z]+)(-?\d+)? ?')
+    GROUP_NAME = re.compile(rb'\{(\\\*)?\\([a-zA-Z]+)')
+    SPECIAL = re.compile(rb'[\\{}]')
+
+    def __init__(self, path: str, encoding: str = 'utf-8'):
+        """
+        Instance initializer.
+
+        Args:
+            path (str): The RTF file to include.
+            encoding (str): Encoding used when the body has to be returned
+                as a str, i.e. by str() and segments(). Should match the
+                encoding of the document being written.
+        """
+        self.path = path
+        self.encoding = encoding
+
+    def body_range(self, data) -> tuple:
+        """
+        Find the body of an RTF file.
+
+        Args:
+            data: The contents of the file (bytes or mmap).
+
+        Returns:
+            (tuple): Start and end offsets of the body.
+        """
+        start = data.find(b'{\\rtf')
+        end = data.rfind(b'}')
+        if start < 0 or end < start:
+            raise ValueError("%s is not an RTF file" % self.path)
+
+        pos = start + 1
+        while pos < end:
+            c = data[pos]
+            if c in b' \t\r\n':
+                pos += 1
+                continue
+            if c == ord('{'):
+                m = RtfInclude.GROUP_NAME.match(data, pos)
+                if m and (m.group(1) or m.group(2) not in RtfInclude.BODY_GROUP_WORDS):  # NOQA
+                    pos = self.skip_group(data, pos)
+                    continue
+            elif c == ord('\\'):
+                m = RtfInclude.CONTROL_WORD.match(data, pos)
+                if m and m.group(1) not in RtfInclude.BODY_WORDS:
+                    pos = m.end()
+                    continue
+            break
+        return min(pos, end), end
+
+    def skip_group(self, data, pos: int) -> int:
+        """
+        Return the offset just past the group that starts at *pos*.
+        """
+        depth = 0
+        while True:
+            m = RtfInclude.SPECIAL.search(data, pos)
+            if m is None:
+                raise ValueError("Unbalanced braces in %s" % self.path)
+            pos = m.end()
+            c = m.group()
+            if c == b'\\':
+                pos += 1  # Skip the escaped character
+            elif c == b'{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+
+    def raw_segments(self):
+        """
+        Yield the body of the file as a memoryview of the mapped file, in a
+        group so that its formatting doesn't carry over to what follows.
+        """
+        with open(self.path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise ValueError("%s is not an RTF file" % self.path)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The map is released when the last view of it is.
+        start, end = self.body_range(data)
+        yield '{'
+        yield memoryview(data)[start:end]
+        yield '}'
+
+    def segments(self):
+        for fragment in self.raw_segments():
+            if isinstance(fragment, str):
+                yield fragment
+            else:
+                yield str(fragment, self.encoding)
+
+    def __str__(self):
+        return ''.join(self.segments())
+
+
 class CaseStyle(object):
     props = (
         'cause_number',
@@ -324,8 +773,30 @@ class CaseStyle(object):
         'doc_title',
     )
     CaseInfo = namedtuple('CaseInfo', props, defaults=(None,) * len(props))
+    CaseInfo.__qualname__ = 'CaseStyle.CaseInfo'  # So it can be pickled
+
+    # Column definitions for the case style table. Every case style uses the
+    # same ones, so every case style shares one TableLayout.
+    COLUMNS = (
+        Table.Column(width=4680, borders='r', alignment='l', property=0),
+        Table.Column(width=4680, alignment='l', property=1),
+    )
 
-    def __init__(self, caseinfo: CaseInfo):
+    def __init__(self, caseinfo: CaseInfo, use_fields: bool = False):
+        """
+        Instance initializer.
+
+        Args:
+            caseinfo (CaseInfo): The case.
+            use_fields (bool): Show the case's names, numbers and title as
+                Fields of document properties rather than as text. Put the
+                values from properties() in the document's
+                Information.properties. The rendered case style then
+                depends only on is_divorce, sensitive, and whether there
+                are no children, one child or several, so it can be reused
+                for other cases that match in those.
+        """
+        self.use_fields = use_fields
         self.cause_number = caseinfo.cause_number
         self.county = caseinfo.county
         self.court_type = caseinfo.court_type
@@ -340,6 +811,35 @@ class CaseStyle(object):
         if isinstance(caseinfo.child_names, list):
             self.child_names = caseinfo.child_names
 
+    def properties(self) -> dict:
+        """
+        Document properties shown by the Fields in a case style rendered
+        with use_fields.
+
+        The names don't overlap with the CaseName, CauseNumber and Title
+        properties of Document(use_fields=True), so both sets can be put
+        in one document without one overwriting the other.
+        """
+        return {
+            'CaptionCauseNumber': self.cause_number,
+            'Petitioner': self.petitioner_name,
+            'Respondent': self.respondent_name,
+            'Children': ', '.join(getattr(self, 'child_names', None) or []),
+            'CourtType': self.court_type,
+            'CourtNumber': self.court_number,
+            'County': self.county,
+            'CaptionTitle': self.doc_title,
+        }
+
+    def value(self, name: str, value: str) -> str:
+        """
+        Produce a value as text, or as a Field for the document property
+        *name* if using fields.
+        """
+        if self.use_fields:
+            return str(Field(name))
+        return value
+
     def __new_str__(self):
         lcol = Table.Column(
             width=4680,
@@ -414,7 +914,7 @@ class CaseStyle(object):
         text = TextRun('Cause No. ', bold_caps)
         paragraph.add_text(text)
         text = TextRun(
-            self.cause_number,
+            self.value('CaptionCauseNumber', self.cause_number),
             TextRun.Properties(underline=TextRun.UNDERLINE_SINGLE, bold=True)
         )
         paragraph.add_text(text)
@@ -436,27 +936,15 @@ class CaseStyle(object):
         #
         # Not every case style has every element that is in the left column
         # above.
-        # Column definitions
-        lcol = Table.Column(
-            width=4680,
-            borders='r',
-            alignment='l',
-            property=0,
-        )
-        rcol = Table.Column(
-            width=4680,
-            alignment='l',
-            property=1,
-        )
-        columns = [lcol, rcol]
+        columns = list(CaseStyle.COLUMNS)
 
         # Construct Data
         t = ""
         if self.is_divorce:
             t += 'In the Matter of\\nThe Marriage of\\n\\n'
-            t += self.petitioner_name
+            t += self.value('Petitioner', self.petitioner_name)
             t += '\\nand\\n'
-            t += self.respondent_name
+            t += self.value('Respondent', self.respondent_name)
             if self.child_names:
                 t += '\\n\\nand '
 
@@ -466,14 +954,17 @@ class CaseStyle(object):
                 capacity = ", a child"
             else:
                 capacity = ", minor children"
-            t += ", ".join(self.child_names)
+            t += self.value('Children', ", ".join(self.child_names))
             t += capacity
         left_content = str(TextRun(t, bold_caps))
 
         # Right column
-        t = 'In the %s Court\\n\\n' % self.court_type
-        t += '%s Court #%s\\n\\n' % (self.court_type, self.court_number)
-        t += '%s County, Texas' % self.county
+        court_type = self.value('CourtType', self.court_type)
+        t = 'In the %s Court\\n\\n' % court_type
+        t += '%s Court #%s\\n\\n' % (
+            court_type, self.value('CourtNumber', self.court_number)
+        )
+        t += '%s County, Texas' % self.value('County', self.county)
         right_content = str(TextRun(t, bold_caps))
         data = [[left_content, right_content]]
 
@@ -490,7 +981,7 @@ class CaseStyle(object):
         p = Paragraph(alignment=Paragraph.ALIGN_CENTER)
         p.add_text(NewLine())
         p.set_header()
-        t = TextRun(self.doc_title, bold_caps)
+        t = TextRun(self.value('CaptionTitle', self.doc_title), bold_caps)
         p.add_text(t)
         p.add_text(NewLine())
         parts.append(str(p))
@@ -513,6 +1004,7 @@ class SignatureBlock(object):
             'role'
         ]
     )
+    Attorney.__qualname__ = 'SignatureBlock.Attorney'  # So it can be pickled
 
     def __init__(self, attorney: Attorney):
         self.attorney = attorney
@@ -540,6 +1032,7 @@ class SignatureBlock(object):
 
 class CertificateOfService(object):
     Recipient = namedtuple('Recipient', ['name', 'role', 'method', 'address'])
+    Recipient.__qualname__ = 'CertificateOfService.Recipient'
 
     def __init__(self, attorney: str, designation: str):
         self.attorney = attorney
@@ -605,44 +1098,323 @@ class CertificateOfService(object):
 
 
 class Document(object):
-    def __init__(self, title: str = None, cause_number: str = None, case_name: str = None):  # NOQA
+    def __init__(self, title: str = None, cause_number: str = None, case_name: str = None, create_time: datetime = None, use_fields: bool = False):  # NOQA
         self.header = Prolog()
         self.font_table = FontTable()
         self.color_table = ColorTable()
-        self.docinfo = Information(title=title)
+        self.list_table = ListTable()
+        self.docinfo = Information(title=title, create_time=create_time)
         self.font_size = 14
         self.paper_dimensions = '\\paperh15840\\paperw12240\n'
         self.magins = Margins()
         self.tabs = TabStops(.5, 1.0, 3.0)
-        self.footer = Footer(case_name=case_name, cause_number=cause_number, title=title)  # NOQA
+        self.footer = Footer(case_name=case_name, cause_number=cause_number, title=title, use_fields=use_fields)  # NOQA
+        if use_fields:
+            self.docinfo.properties.update({
+                'CaseName': case_name,
+                'CauseNumber': cause_number,
+                'Title': title,
+            })
         self.preliminaries = OtherPreliminaries()
         self.content_sections = []
         self.title = title
         self.cause_number = cause_number
         self.case_name = case_name
+        self.parallel_threshold = 5000
 
     def add_content(self, content):
+        if isinstance(content, NumberedList) and content not in self.list_table:  # NOQA
+            self.list_table.add_list(content)
         self.content_sections.append(content)
 
+    def header_parts(self) -> list:
+        """
+        Produce the named pieces of RTF that precede the content sections.
+
+        Returns:
+            (list): (name, rtf) tuples in document order.
+        """
+        return [
+            ('open', '{'),
+            ('prolog', str(self.header)),
+            ('font_table', str(self.font_table)),
+            ('color_table', str(self.color_table)),
+            ('list_table', str(self.list_table)),
+            ('info', str(self.docinfo)),
+            ('font_size', '\\fs{}\n'.format(self.font_size * 2)),
+            ('paper', str(self.paper_dimensions)),
+            ('margins', str(self.magins)),
+            ('tabs', str(self.tabs)),
+            ('footer', str(self.footer)),
+            ('preliminaries', str(self.preliminaries)),
+        ]
+
+    def header_segments(self):
+        """
+        Yield the RTF that precedes the content sections.
+        """
+        for name, rtf in self.header_parts():
+            yield rtf
+
+    def segments(self, raw: bool = False):
+        """
+        Yield the document as a sequence of RTF fragments, in order.
+
+        Joining the fragments produces exactly the same text as str(self),
+        but a writer can send them to the output without building one big
+        string first.
+
+        Args:
+            raw (bool): If True, sections that can (e.g. RtfInclude) yield
+                bytes-like fragments instead of str. Only for writers that
+                accept bytes.
+        """
+        yield from self.header_segments()
+        for section in self.content_sections:
+            yield from section_segments(section, raw)
+        yield '}'
+
     def __str__(self):
-        sections = [str(s) for s in self.content_sections]
-        content = ''.join(sections)
-        return (
-            '{' +
-            str(self.header) +
-            str(self.font_table) +
-            str(self.color_table) +
-            str(self.docinfo) +
-            '\\fs{}\n'.format(self.font_size * 2) +
-            str(self.paper_dimensions) +
-            str(self.magins) +
-            str(self.tabs) +
-            str(self.footer) +
-            str(self.preliminaries) +
-            content +
-            '}'
+        return ''.join(self.segments())
+
+    def render(
+        self,
+        parallel: int = 1,
+        threshold: int = None,
+        use_processes: bool = True
+    ) -> str:
+        """
+        Render the document, optionally spreading the work over several
+        workers.
+
+        The content sections are split into contiguous chunks which are
+        rendered by the workers and reassembled in order, so the result is
+        identical to str(self).
+
+        Args:
+            parallel (int): Number of workers. 1 renders serially.
+            threshold (int): Minimum size, as counted by section_weight(),
+                before workers are used. Smaller documents are rendered
+                serially because starting workers would cost more than it
+                saves. Defaults to self.parallel_threshold.
+            use_processes (bool): Render in worker processes (True) or
+                threads (False). Processes need the content sections to be
+                picklable and, on platforms that spawn rather than fork,
+                the caller must be protected by `if __name__ == '__main__'`.
+
+        Returns:
+            (str): The RTF document.
+        """
+        if threshold is None:
+            threshold = self.parallel_threshold
+        weights = [section_weight(s) for s in self.content_sections]
+        if parallel <= 1 or len(weights) < 2 or sum(weights) < threshold:
+            return str(self)
+
+        # Several chunks per worker so that one slow chunk doesn't leave
+        # the other workers idle.
+        ranges = split_sections(weights, parallel * 4)
+        if use_processes:
+            # Workers get the sections once, when they start (for free if
+            # the platform forks), and are then sent only index ranges.
+            executor = ProcessPoolExecutor(
+                max_workers=parallel,
+                initializer=_set_worker_sections,
+                initargs=(self.content_sections,)
+            )
+            work = _render_worker_range
+        else:
+            executor = ThreadPoolExecutor(max_workers=parallel)
+            sections = self.content_sections
+
+            def work(bounds):
+                return render_sections(sections[bounds[0]:bounds[1]])
+
+        with executor:
+            bodies = list(executor.map(work, ranges))
+        return ''.join(self.header_segments()) + ''.join(bodies) + '}'
+
+
+class StreamingDocument(Document):
+    """
+    A Document that writes each content section as soon as it is added,
+    instead of keeping it until the whole document is rendered.
+
+    Memory use doesn't grow with the length of the document. The header
+    (font table, color table, margins, footer, etc.) is written when the
+    document is opened, so change those before calling open() or adding
+    the first content. The result is identical to str() of a Document
+    with the same header and content.
+
+    Example:
+        with open('exhibit.rtf', 'w') as f:
+            with StreamingDocument(f, title, cause_number, case_name) as doc:
+                for line in lines:
+                    doc.add_content(line)
+    """
+    def __init__(
+        self,
+        output,
+        title: str = None,
+        cause_number: str = None,
+        case_name: str = None,
+        create_time: datetime = None,
+        use_fields: bool = False
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            output: Anything with a write(str) method, e.g. a file opened in
+                text mode or a writer.SegmentWriter.
+            title (str): Document title.
+            cause_number (str): Cause number for the footer.
+            case_name (str): Case name for the footer.
+            create_time (datetime): As for Information.
+            use_fields (bool): As for Document.
+        """
+        super().__init__(
+            title, cause_number, case_name, create_time, use_fields
+        )
+        self.output = output
+        self.is_open = False
+        self.is_closed = False
+
+    def open(self):
+        """
+        Write the document header.
+        """
+        if self.is_open:
+            return
+        for segment in self.header_segments():
+            self.output.write(segment)
+        self.is_open = True
+
+    def add_content(self, content):
+        """
+        Write a content section and let it go.
+        """
+        if self.is_closed:
+            raise ValueError("Can't add content to a closed document")
+        if isinstance(content, NumberedList) and content not in self.list_table:  # NOQA
+            if self.is_open:
+                raise ValueError(
+                    "NumberedLists must be added to list_table before the "
+                    "document is opened"
+                )
+            self.list_table.add_list(content)
+        self.open()
+        raw = getattr(self.output, 'accepts_bytes', False)
+        for segment in section_segments(content, raw):
+            self.output.write(segment)
+
+    def close(self):
+        """
+        Write the end of the document. The output is not closed.
+        """
+        if self.is_closed:
+            return
+        self.open()
+        self.output.write('}')
+        self.is_closed = True
+
+    # Content is written as it is added and not kept, so there is nothing
+    # for these to render. Raise instead of producing an empty document.
+    def segments(self, raw: bool = False):
+        raise TypeError(
+            "A StreamingDocument is written to its output as content is "
+            "added and can't be rendered again"
         )
 
+    def render(self, *args, **kwargs):
+        self.segments()
+
+    def __str__(self):
+        self.segments()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def section_weight(section) -> int:
+    """
+    Rough rendering cost of a content section: one per row for a Table,
+    otherwise one.
+    """
+    if isinstance(section, Table):
+        return len(section.data) + 1
+    return 1
+
+
+def split_sections(weights: list, count: int) -> list:
+    """
+    Split sections into at most *count* contiguous chunks of similar weight.
+
+    Args:
+        weights (list): section_weight() of each section.
+        count (int): Maximum number of chunks.
+
+    Returns:
+        (list): (start, end) slice bounds for each chunk.
+    """
+    target = sum(weights) / count
+    ranges = []
+    start = 0
+    chunk_weight = 0
+    for i, weight in enumerate(weights):
+        chunk_weight += weight
+        if chunk_weight >= target:
+            ranges.append((start, i + 1))
+            start = i + 1
+            chunk_weight = 0
+    if start < len(weights):
+        ranges.append((start, len(weights)))
+    return ranges
+
+
+def render_sections(sections: list) -> str:
+    """
+    Render a list of content sections.
+    """
+    return ''.join(
+        segment
+        for section in sections
+        for segment in section_segments(section)
+    )
+
+
+# Content sections of the Document being rendered by this worker process.
+_worker_sections = []
+
+
+def _set_worker_sections(sections: list):
+    global _worker_sections
+    _worker_sections = sections
+
+
+def _render_worker_range(bounds: tuple) -> str:
+    return render_sections(_worker_sections[bounds[0]:bounds[1]])
+
+
+def section_segments(section, raw: bool = False):
+    """
+    Yield the RTF fragments for one content section.
+
+    Sections that know how to render themselves in pieces (e.g. Table)
+    provide a segments() method; anything else is rendered with str().
+    If *raw* is True, sections with a raw_segments() method (e.g.
+    RtfInclude) yield bytes-like fragments from it instead.
+    """
+    if raw and hasattr(section, 'raw_segments'):
+        yield from section.raw_segments()
+    elif hasattr(section, 'segments'):
+        yield from section.segments()
+    else:
+        yield str(section)
+
 
 def main():
     # This is the information we need from our database
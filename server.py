@@ -0,0 +1,674 @@
+"""
+server.py - A local HTTP service that renders RTF documents.
+
+Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
+"""
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import json
+import os
+import sys
+import threading
+import time
+
+from mdimport import read_markdown
+from pyrtf import CaseStyle, Document, SignatureBlock, escape
+
+
+def build_document(spec: dict) -> Document:
+    """
+    Build a Document from a JSON request.
+
+    Args:
+        spec (dict): Request in the form:
+
+            {
+                "title": "Responses to Requests for Production",
+                "cause_number": "469-55555-2019",
+                "case_name": "IMMO Doe and Doe",
+                "colors": [[255, 0, 0]],
+                "case_info": {... CaseStyle.CaseInfo fields ...},
+                "markdown": "# Heading\\n\\nBody text ...",
+                "number_format": "REQUEST NO. {}:",
+                "signature": {... SignatureBlock.Attorney fields ...}
+            }
+
+            Everything except "title" is optional. "markdown" is converted
+            with mdimport. Text is plain text, not RTF: it is escaped.
+
+    Returns:
+        (Document): The document.
+
+    Raises:
+        ValueError: If the request is not in this form.
+    """
+    check_spec(spec)
+    document = Document(
+        escape(spec['title']),
+        escape(spec.get('cause_number', '')),
+        escape(spec.get('case_name', ''))
+    )
+    for color in spec.get('colors', []):
+        document.color_table.add_color(tuple(color))
+    if spec.get('case_info'):
+        document.add_content(case_style(_freeze(spec['case_info'])))
+    if spec.get('markdown'):
+        options = {}
+        if spec.get('number_format'):
+            options['number_format'] = spec['number_format']
+        lines = spec['markdown'].splitlines()
+        for content in read_markdown(lines, **options):
+            document.add_content(content)
+    if spec.get('signature'):
+        document.add_content(signature_block(_freeze(spec['signature'])))
+    return document
+
+
+def check_spec(spec):
+    """
+    Check that a request has the form described in build_document().
+
+    Raises:
+        ValueError: Describes the first problem found.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Request must be a JSON object")
+    if not isinstance(spec.get('title'), str):
+        raise ValueError("'title' is required and must be a string")
+    for name in ('cause_number', 'case_name', 'markdown', 'number_format'):
+        if not isinstance(spec.get(name, ''), str):
+            raise ValueError("'%s' must be a string" % name)
+    number_format = spec.get('number_format', '{}')
+    if number_format and (
+        '{}' not in number_format or
+        '{' in number_format.replace('{}', '', 1) or
+        '}' in number_format.replace('{}', '', 1)
+    ):
+        raise ValueError(
+            "'number_format' must contain {} exactly once, and no other "
+            "braces"
+        )
+
+    colors = spec.get('colors', [])
+    if not isinstance(colors, list) or not all(
+        isinstance(color, list) and len(color) == 3 and
+        all(isinstance(c, int) and 0 <= c <= 255 for c in color)
+        for color in colors
+    ):
+        raise ValueError("'colors' must be a list of [red, green, blue]")
+
+    case_info = spec.get('case_info') or {}
+    if not isinstance(case_info, dict):
+        raise ValueError("'case_info' must be an object")
+    for name, value in case_info.items():
+        if name not in CaseStyle.CaseInfo._fields:
+            raise ValueError("Unknown case_info field '%s'" % name)
+        if not (value is None or isinstance(value, (str, bool)) or (
+            isinstance(value, list) and
+            all(isinstance(v, str) for v in value)
+        )):
+            raise ValueError("Invalid case_info field '%s'" % name)
+    if case_info:
+        required = [
+            'cause_number', 'court_type', 'court_number', 'county',
+            'child_names',
+        ]
+        if case_info.get('is_divorce'):
+            required += ['petitioner_name', 'respondent_name']
+        for name in required:
+            if case_info.get(name) is None:
+                raise ValueError("'case_info' needs '%s'" % name)
+
+    signature = spec.get('signature') or {}
+    if not isinstance(signature, dict):
+        raise ValueError("'signature' must be an object")
+    if signature and set(signature) != set(SignatureBlock.Attorney._fields):
+        raise ValueError(
+            "'signature' must have exactly the fields: " +
+            ', '.join(SignatureBlock.Attorney._fields)
+        )
+    if not all(isinstance(v, str) for v in signature.values()):
+        raise ValueError("'signature' fields must be strings")
+
+
+def _freeze(fields: dict) -> tuple:
+    """
+    Turn a dict of fields into a hashable key for the caches below,
+    escaping the text in it.
+    """
+    def freeze(value):
+        if isinstance(value, list):
+            return tuple(escape(v) for v in value)
+        if isinstance(value, str):
+            return escape(value)
+        return value
+
+    return tuple(sorted((k, freeze(v)) for k, v in fields.items()))
+
+
+# Each worker keeps the case styles and signature blocks it has rendered,
+# since the same few cases and attorneys come up again and again.
+@lru_cache(maxsize=256)
+def case_style(fields: tuple) -> str:
+    fields = {k: list(v) if isinstance(v, tuple) else v for k, v in fields}
+    return str(CaseStyle(CaseStyle.CaseInfo(**fields)))
+
+
+@lru_cache(maxsize=64)
+def signature_block(fields: tuple) -> str:
+    return str(SignatureBlock(SignatureBlock.Attorney(**dict(fields))))
+
+
+def render_request(spec: dict) -> bytes:
+    """
+    Render a JSON request to RTF. Runs in a worker process.
+
+    The whole document is rendered and returned at once, since results
+    come back from a process pool in one piece.
+    """
+    return str(build_document(spec)).encode('utf-8')
+
+
+def stream_request(spec: dict, put, chunk_size: int):
+    """
+    Render a JSON request to RTF as it is needed. Runs in a worker thread.
+
+    Args:
+        spec (dict): The request.
+        put: Called with each chunk of the encoded document, of about
+            *chunk_size* bytes. It blocks while the client falls behind.
+        chunk_size (int): Bytes to gather before calling *put*.
+    """
+    pending = []
+    size = 0
+    for segment in build_document(spec).segments():
+        data = segment.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            put(b''.join(pending))
+            pending = []
+            size = 0
+    if pending:
+        put(b''.join(pending))
+
+
+def _warm_up():
+    """
+    Build and render a sample document when a worker starts, so the first
+    real request doesn't pay for it.
+    """
+    render_request({'title': 'Warm up', 'markdown': '# Warm up\n\nText.'})
+
+
+class RenderServer(object):
+    """
+    Renders documents on request using a pool of long-lived workers.
+
+    POST /render    Body is a JSON request (see build_document()). The
+                    response is the RTF document. With worker threads it
+                    is streamed (chunked transfer encoding) as it is
+                    rendered. Worker processes return the whole document,
+                    which is then sent with a Content-Length.
+    GET /stats      Request counts and latency percentiles as JSON.
+
+    When max_queue requests are already being rendered or waiting, new
+    render requests are refused with 503 Service Unavailable so that a
+    burst of work can't pile up without limit. Request bodies larger than
+    max_body are refused with 413 Payload Too Large.
+    """
+    CHUNK_SIZE = 65536
+    MAX_BODY = 16 * 1024 * 1024
+    STREAM_CHUNKS = 4  # Chunks a streaming worker may get ahead by
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        unix_path: str = None,
+        workers: int = None,
+        max_queue: int = None,
+        use_processes: bool = True,
+        max_body: int = None
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            host (str): Address to listen on.
+            port (int): TCP port to listen on. 0 picks a free port; see
+                self.port after start().
+            unix_path (str): If given, listen on this Unix socket instead of
+                TCP.
+            workers (int): Number of workers. Defaults to the CPU count.
+            max_queue (int): Most requests rendering or waiting at once.
+                Defaults to four per worker.
+            use_processes (bool): Use worker processes (True) or threads.
+            max_body (int): Largest request body accepted, in bytes.
+                Defaults to MAX_BODY.
+        """
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or self.workers * 4
+        self.use_processes = use_processes
+        self.max_body = max_body or RenderServer.MAX_BODY
+        self.executor = None
+        self.server = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=10000)
+
+    async def start(self):
+        if self.use_processes:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_warm_up
+            )
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                initializer=_warm_up
+            )
+
+        # Start the workers before accepting connections. Workers forked
+        # later would inherit the sockets of open connections and keep them
+        # from closing.
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self.executor, os.getpid)
+            for _ in range(self.workers)
+        ])
+
+        if self.unix_path:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path=self.unix_path
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, self.host, self.port
+            )
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def handle(self, reader, writer):
+        """
+        Handle one HTTP connection. Keep-alive is not supported.
+        """
+        try:
+            request_line = await reader.readline()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = b''
+            if 'content-length' in headers:
+                try:
+                    length = int(headers['content-length'])
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, b'Invalid Content-Length')
+                    return
+                if length > self.max_body:
+                    await self.respond(writer, 413, b'Request too large')
+                    return
+                body = await reader.readexactly(length)
+
+            if method == 'POST' and path == '/render':
+                await self.render(body, writer)
+            elif method == 'GET' and path == '/stats':
+                await self.respond(
+                    writer, 200, json.dumps(self.stats()).encode('utf-8'),
+                    'application/json'
+                )
+            else:
+                await self.respond(writer, 404, b'Not Found')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def render(self, body: bytes, writer):
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            await self.respond(
+                writer, 503, b'Busy', headers={'Retry-After': '1'}
+            )
+            return
+        try:
+            spec = json.loads(body)
+        except ValueError:
+            await self.respond(writer, 400, b'Invalid JSON')
+            return
+        try:
+            check_spec(spec)
+        except ValueError as e:
+            await self.respond(writer, 400, str(e).encode('utf-8'))
+            return
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if self.use_processes:
+                loop = asyncio.get_running_loop()
+                try:
+                    rtf = await loop.run_in_executor(
+                        self.executor, render_request, spec
+                    )
+                except Exception as e:
+                    self.failed += 1
+                    await self.respond(writer, 500, str(e).encode('utf-8'))
+                    return
+                await self.respond(writer, 200, rtf, 'application/rtf')
+            elif not await self.stream(spec, writer):
+                self.failed += 1
+                return
+        finally:
+            self.in_flight -= 1
+        self.latencies.append(time.perf_counter() - start)
+        self.completed += 1
+
+    async def stream(self, spec: dict, writer) -> bool:
+        """
+        Render a request in a worker thread, sending each chunk to the
+        client as soon as it is ready.
+
+        The worker can only get STREAM_CHUNKS chunks ahead of the client.
+        If the client goes away, the worker stops at its next chunk.
+
+        Returns:
+            (bool): True if the whole document was sent.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.STREAM_CHUNKS)
+        cancelled = threading.Event()
+
+        def put(chunk):
+            if cancelled.is_set():
+                raise ConnectionError("Client disconnected")
+            asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+
+        future = loop.run_in_executor(
+            self.executor, stream_request, spec, put, self.CHUNK_SIZE
+        )
+        # None marks the end of the document.
+        future.add_done_callback(
+            lambda _: asyncio.ensure_future(queue.put(None))
+        )
+        try:
+            chunk = await queue.get()
+            if chunk is None and future.exception():
+                await self.respond(
+                    writer, 500, str(future.exception()).encode('utf-8')
+                )
+                return False
+            await self.send_headers(
+                writer, 200, 'application/rtf',
+                {'Transfer-Encoding': 'chunked'}
+            )
+            while chunk is not None:
+                writer.write(b'%x\r\n' % len(chunk))
+                writer.write(chunk)
+                writer.write(b'\r\n')
+                await writer.drain()
+                chunk = await queue.get()
+            if future.exception():
+                # Too late for an error status. Closing the connection
+                # without the last chunk tells the client it failed.
+                return False
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            return True
+        finally:
+            if not future.done():
+                # Unblock the worker so that it sees it has been cancelled.
+                cancelled.set()
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([future])
+                future.exception()  # Expected; don't log it as unhandled
+
+    async def respond(
+        self,
+        writer,
+        status: int,
+        body: bytes,
+        content_type: str = 'text/plain',
+        headers: dict = None
+    ):
+        """
+        Send an HTTP response whose body is already complete. It is written
+        in chunks, waiting for the client to keep up, so that a slow client
+        doesn't make the transport buffer a second copy of it.
+        """
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(len(body))
+        await self.send_headers(writer, status, content_type, headers)
+        view = memoryview(body)
+        for i in range(0, len(view), self.CHUNK_SIZE):
+            writer.write(view[i:i + self.CHUNK_SIZE])
+            await writer.drain()
+        await writer.drain()
+
+    async def send_headers(
+        self,
+        writer,
+        status: int,
+        content_type: str,
+        headers: dict
+    ):
+        reasons = {
+            200: 'OK',
+            400: 'Bad Request',
+            404: 'Not Found',
+            413: 'Payload Too Large',
+            500: 'Internal Server Error',
+            503: 'Service Unavailable',
+        }
+        lines = [
+            'HTTP/1.1 {} {}'.format(status, reasons[status]),
+            'Content-Type: {}'.format(content_type),
+            'Connection: close',
+        ]
+        for name, value in headers.items():
+            lines.append('{}: {}'.format(name, value))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def stats(self) -> dict:
+        """
+        Request counts and render latency percentiles, in milliseconds, over
+        the most recent requests.
+        """
+        ordered = sorted(self.latencies)
+
+        def percentile(p):
+            if not ordered:
+                return None
+            rank = max(0, int(round(p / 100.0 * len(ordered))) - 1)
+            return round(ordered[rank] * 1000.0, 3)
+
+        return {
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'max_queue': self.max_queue,
+            'workers': self.workers,
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+        }
+
+
+async def request(
+    port: int,
+    method: str,
+    path: str,
+    body: bytes = b''
+) -> tuple:
+    """
+    Make one HTTP request to a server on localhost.
+
+    Returns:
+        (tuple): Status code, dict of headers (names in lower case), and
+            body, with any chunked transfer encoding removed.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(
+            '{} {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(
+                method, path, len(body)
+            ).encode('latin-1') + body
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, data = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        chunks = []
+        while True:
+            size, _, data = data.partition(b'\r\n')
+            size = int(size, 16)
+            if not size:
+                break
+            chunks.append(data[:size])
+            data = data[size + 2:]
+        data = b''.join(chunks)
+    return int(lines[0].split()[1]), headers, data
+
+
+async def check_server(use_processes: bool) -> list:
+    """
+    Start a server on localhost and check /render, the 503 response when
+    it is busy, and /stats.
+
+    Returns:
+        (list): A description of each check that failed.
+    """
+    failures = []
+
+    def expect(ok: bool, what: str):
+        if not ok:
+            failures.append(what)
+
+    server = RenderServer(
+        workers=1, max_queue=1, use_processes=use_processes
+    )
+    await server.start()
+    try:
+        spec = {'title': 'Check', 'markdown': '# Heading\n\nSome *text*.'}
+        status, _, rtf = await request(
+            server.port, 'POST', '/render', json.dumps(spec).encode('utf-8')
+        )
+        expect(status == 200, '/render status %s' % status)
+        expect(rtf.startswith(b'{\\rtf1') and rtf.endswith(b'}'),
+               '/render did not return an RTF document')
+        expect(b'{\\title Check}' in rtf, '/render ignored the title')
+
+        status, _, _ = await request(server.port, 'POST', '/render', b'{}')
+        expect(status == 400, 'request without a title got %s' % status)
+
+        # Fill the only place in the queue with a large document, then
+        # check that a second request is turned away.
+        markdown = '\n\n'.join('Paragraph %d.' % i for i in range(30000))
+        big = asyncio.ensure_future(request(
+            server.port, 'POST', '/render',
+            json.dumps({'title': 'Big', 'markdown': markdown}).encode('utf-8')
+        ))
+        while not big.done() and server.in_flight == 0:
+            await asyncio.sleep(0.001)
+        expect(server.in_flight == 1, 'could not fill the queue')
+        status, headers, _ = await request(
+            server.port, 'POST', '/render', json.dumps(spec).encode('utf-8')
+        )
+        expect(status == 503, 'busy server answered %s' % status)
+        expect(headers.get('retry-after') == '1', '503 without Retry-After')
+        status, _, _ = await big
+        expect(status == 200, 'large /render status %s' % status)
+
+        status, _, body = await request(server.port, 'GET', '/stats')
+        expect(status == 200, '/stats status %s' % status)
+        stats = json.loads(body)
+        expect(stats['completed'] == 2, 'completed is %s' % stats['completed'])
+        expect(stats['rejected'] == 1, 'rejected is %s' % stats['rejected'])
+        expect(stats['in_flight'] == 0, 'in_flight is %s' % stats['in_flight'])
+        expect(stats['p50_ms'] is not None, 'no latencies')
+    finally:
+        await server.stop()
+    return failures
+
+
+def check() -> list:
+    """
+    Run check_server() with worker processes and with worker threads.
+    """
+    failures = []
+    for use_processes in (True, False):
+        mode = 'processes' if use_processes else 'threads'
+        for failure in asyncio.run(check_server(use_processes)):
+            print('FAILED ({}): {}'.format(mode, failure))
+            failures.append((mode, failure))
+        print('checked /render, 503 and /stats with worker %s' % mode)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render RTF documents.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Listen on this Unix socket path')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-queue', type=int)
+    parser.add_argument('--max-body', type=int,
+                        help='Largest request body accepted, in bytes')
+    parser.add_argument('--check', action='store_true',
+                        help='Check the server on localhost, then exit')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check() else 0)
+
+    server = RenderServer(
+        host=args.host,
+        port=args.port,
+        unix_path=args.unix,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        max_body=args.max_body
+    )
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ table.py - Create an RTF table.
 Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
 """
 from collections import namedtuple
+from functools import lru_cache
+
+PAGE_WIDTH = 1440 * 6.5  # Twips. 8.5 x 11, portrait paper, 1" margins
 
 
 class Table(object):
@@ -27,14 +30,23 @@ class Table(object):
         props,
         defaults=(None,) * len(props)
     )
-
-    def __init__(self, columns: list, data, lmargin: int = 0):
+    Column.__qualname__ = 'Table.Column'  # So columns can be pickled
+
+    def __init__(
+        self,
+        columns: list,
+        data,
+        lmargin: int = 0,
+        page_width: float = PAGE_WIDTH
+    ):
         """
         Instance initializer.
 
         Args:
             columns (list): A list of Column tuples wherein:
-                width = width of column in twips OR a float as a percentage
+                width = width of column in twips, a fraction of the page
+                    width (a float no greater than 1), or a percent string
+                    such as '20%'
                 borders = Any combination of lrtb indicating left, right, top &
                     bottom.
                 alignment = One of (l)eft, (r)ight, (c)enter, or (j)ustified
@@ -53,6 +65,8 @@ class Table(object):
                 for that column.
 
             lmargin = Number of twips from left edge of page to begin
+
+            page_width = Width in twips between the page margins
         """
         # If someone wanted a single-column table and failed to put the Column
         # specification in a list, fix that here. (Who would DO that?)
@@ -62,37 +76,55 @@ class Table(object):
             self.columns = columns
         self.data = data
         self.lmargin = lmargin
+        self.page_width = page_width
+
+    @property
+    def layout(self) -> 'TableLayout':
+        """
+        The shared TableLayout for this table's columns and margins.
+        """
+        return TableLayout.get(self.columns, self.lmargin, self.page_width)
 
     def __str__(self):
         """
         Produce RTF to represent the table.
         """
-        # Specify column widths
-        rtf_widths = self.column_widths()
-        cells = self.column_rtf_templates()
-        rows = []
+        return ''.join(self.segments())
+
+    def segments(self):
+        """
+        Yield the RTF for the table one row at a time.
+
+        Joining the fragments produces the same text as str(self).
+        """
+        yield '\n'
+        for r_idx, row in enumerate(self.rows()):
+            if r_idx:
+                yield '\n'
+            yield row
+        yield '\n'
+
+    def rows(self):
+        """
+        Yield the RTF for each row of the table, header row first.
+        """
+        layout = self.layout
+        row_start = self.begin_row() + layout.widths
+        row_end = self.end_row()
 
         # Format the column headers, if present
-        if self.has_headers():
-            rtf = self.headers(cells)
-            rows.append(
-                self.begin_row() +
-                rtf_widths +
-                rtf +
-                self.end_row())
+        if layout.has_headers:
+            yield row_start + self.headers(layout.cells) + row_end
 
         # Format each row of data.
-        for r_idx, row in enumerate(self.data):
-            rtf = self.data_row(cells, row)
-            rows.append(
-                self.begin_row() +
-                rtf_widths +
-                rtf +
-                self.end_row()
-            )
-
-        # Put it all together and send back to caller
-        return '\n' + '\n'.join(rows) + '\n'
+        data_cells = layout.data_cells
+        columns = layout.columns
+        for row in self.data:
+            cells_rtf = [
+                cell % self.data_value(column, row)
+                for cell, column in zip(data_cells, columns)
+            ]
+            yield row_start + '{' + ''.join(cells_rtf) + '}\n' + row_end
 
     def begin_row(self):
         """
@@ -115,10 +147,7 @@ class Table(object):
         Returns:
             (bool): True if at least one column has a header, otherwise False.
         """
-        for column in self.columns:
-            if column.header is not None:
-                return True
-        return False
+        return self.layout.has_headers
 
     def headers(self, cells) -> str:
         """
@@ -128,11 +157,7 @@ class Table(object):
         for c, cell in enumerate(cells):
             column = self.columns[c]
             if column.header is not None:
-                col_rtf = ''
-                if column.hfont is not None:
-                    col_rtf += '\\f{}'.format(column.hfont)
-                if column.hcolor is not None:
-                    col_rtg += '\\cf{}'.format(column.hcolor)
+                col_rtf = self.layout.header_codes[c]
                 col_rtf += ' ' + column.header
                 headers.append(cell % col_rtf)
         return '{' + ''.join(headers) + '}\n'
@@ -148,11 +173,7 @@ class Table(object):
         cells_rtf = []
         for c, cell in enumerate(cells):
             column = self.columns[c]
-            cell_rtf = ''
-            if column.dfont is not None:
-                cell_rtf += '\\f{}'.format(column.dfont)
-            if column.dcolor is not None:
-                cell_rtf += '\\cf{}'.format(column.dcolor)
+            cell_rtf = self.layout.data_codes[c]
             cell_rtf += self.data_value(column, data)
             cells_rtf.append(cell % cell_rtf)
         return '{' + ''.join(cells_rtf) + '}\n'
@@ -174,6 +195,92 @@ class Table(object):
             return data[column.property]
         return "#ERR#"
 
+    def column_rtf_templates(self) -> list:
+        return list(self.layout.cells)
+
+    def column_widths(self) -> str:
+        return self.layout.widths
+
+
+class TableLayout(object):
+    """
+    Everything about a table's RTF that depends only on its columns, left
+    margin and page width: the \\cellx column extents, the cell templates,
+    and the font and color codes for each column.
+
+    Computing a layout checks the column specifications, so a layout that
+    exists is valid. Layouts are cached by get(), so all tables with the
+    same columns, left margin and page width share one.
+    """
+    def __init__(
+        self,
+        columns: list,
+        lmargin: int = 0,
+        page_width: float = PAGE_WIDTH
+    ):
+        """
+        Instance initializer. Use TableLayout.get() to share layouts.
+
+        Args:
+            columns (list): Table.Column specifications.
+            lmargin (int): Twips from the left edge of the page.
+            page_width (float): Width in twips between the page margins.
+        """
+        self.columns = tuple(columns)
+        self.lmargin = lmargin
+        self.page_width = page_width
+        if not self.columns:
+            raise ValueError("A table must have at least one column")
+        if lmargin >= page_width:
+            raise ValueError("Table lmargin must be less than the page width")
+
+        self.widths = self.column_widths()
+        self.cells = tuple(self.column_rtf_templates())
+        self.has_headers = any(c.header is not None for c in self.columns)
+        self.header_codes = tuple(
+            self.codes(c.hfont, c.hcolor) for c in self.columns
+        )
+        data_codes = []
+        for column in self.columns:
+            codes = self.codes(column.dfont, column.dcolor)
+            # A space ends the last control word, so that data beginning
+            # with a digit isn't read as part of its number.
+            data_codes.append(codes + ' ' if codes else '')
+        self.data_codes = tuple(data_codes)
+        # Cell templates with the data font and color already filled in.
+        self.data_cells = tuple(
+            cell % (codes.replace('%', '%%') + '%s')
+            for cell, codes in zip(self.cells, self.data_codes)
+        )
+
+    @classmethod
+    def get(
+        cls,
+        columns: list,
+        lmargin: int = 0,
+        page_width: float = PAGE_WIDTH
+    ) -> 'TableLayout':
+        """
+        Get the shared layout for a set of columns, computing it only the
+        first time it is asked for.
+        """
+        try:
+            return _cached_layout(tuple(columns), lmargin, page_width)
+        except TypeError:
+            # Something in the columns can't be hashed. Don't cache.
+            return cls(columns, lmargin, page_width)
+
+    def codes(self, font, color) -> str:
+        """
+        Produce the font and color control words for a cell.
+        """
+        codes = ''
+        if font is not None:
+            codes += '\\f{}'.format(font)
+        if color is not None:
+            codes += '\\cf{}'.format(color)
+        return codes
+
     def column_rtf_templates(self) -> list:
         cols = []
         for column in self.columns:
@@ -188,14 +295,13 @@ class Table(object):
 
     def column_widths(self) -> str:
         widths = []
-        doc_width = 1440 * 6.5  # Assuming 8.5 x 11, portrait paper, 1" margins
         use_percent = False
         use_units = False
 
         for column in self.columns:
             # Convert a percentage string, e.g. '20%' into a float: 0.2
-            if isinstance(column.width, str) and column.width[-1] == '%':
-                w = float('.' + column.width[:-1])
+            if isinstance(column.width, str) and column.width[-1:] == '%':
+                w = float(column.width[:-1]) / 100.0
             # Convert a str to float
             elif isinstance(column.width, str):
                 w = float(column.width)
@@ -204,14 +310,15 @@ class Table(object):
                 w = column.width
             else:
                 raise ValueError("Column.width must be a percent string, e.g. '20%', an int, or a float")  # NOQA
+            if w <= 0:
+                raise ValueError("Column.width must be greater than zero")
 
-            # Assume that a value less than one is a decimal (percent)
+            # Assume that a value no more than one is a fraction of the page
             if w > 1:
                 use_units = True
-                w = int(column.width)
             else:
                 use_percent = True
-                w = w * doc_width
+                w = w * self.page_width
 
             # Add to our widths list.
             widths.append(w)
@@ -220,14 +327,9 @@ class Table(object):
         if use_percent and use_units:
             raise ValueError("All Column.widths must be the same type, either percent or units (twips)")  # NOQA
 
-        # Coerce widths to fix total width of the page.
+        # Coerce widths to fit the total width of the page.
         total_width = sum(widths)
-        coerced_widths = [w / total_width * (doc_width - self.lmargin) for w in widths]  # NOQA
-
-        # Convert decimals to widths in twips
-        if use_percent:
-            widths = [w * (doc_width - self.lmargin) for w in coerced_widths]
-            coerced_widths = widths
+        coerced_widths = [w / total_width * (self.page_width - self.lmargin) for w in widths]  # NOQA
 
         # Convert widths to extents
         total_width = 0
@@ -239,3 +341,8 @@ class Table(object):
         # Finally, create the column extents specification
         widths = ['\\cellx{}'.format(int(w)) for w in extents]
         return ''.join(widths) + '\n'
+
+
+@lru_cache(maxsize=1024)
+def _cached_layout(columns: tuple, lmargin: int, page_width: float):
+    return TableLayout(columns, lmargin, page_width)
@@ -0,0 +1,531 @@
+"""
+writer.py - Write RTF documents to disk without joining them first.
+
+Copyright (c) 2019 by Thomas J. Daley, J.D. All Rights Reserved.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from pyrtf import Document, Paragraph, TextRun, section_segments
+from table import Table
+
+# Most systems allow 1024 buffers per writev() call. Ask, in case this one
+# is different.
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+
+class SegmentWriter(object):
+    """
+    Collects rendered RTF fragments and writes them with os.writev().
+
+    Fragments are held as a list of separate buffers and handed to the
+    operating system in batches of at most IOV_MAX, so they are never
+    copied into one combined buffer.
+    """
+    accepts_bytes = True
+
+    def __init__(
+        self,
+        fd: int,
+        encoding: str = 'utf-8',
+        batch_size: int = IOV_MAX
+    ):
+        """
+        Instance initializer.
+
+        Args:
+            fd (int): File descriptor open for writing.
+            encoding (str): Encoding used for str fragments.
+            batch_size (int): Maximum number of buffers per writev() call.
+                Values above IOV_MAX are reduced to IOV_MAX.
+        """
+        self.fd = fd
+        self.encoding = encoding
+        self.batch_size = max(1, min(batch_size, IOV_MAX))
+        self.buffers = []
+        self.position = 0
+
+    def write(self, segment):
+        """
+        Queue one fragment for output.
+
+        Args:
+            segment: A str, or any bytes-like object. Bytes-like objects are
+                written as-is, without being copied.
+        """
+        if isinstance(segment, str):
+            segment = segment.encode(self.encoding)
+        if not len(segment):
+            return
+        self.buffers.append(segment)
+        self.position += len(segment)
+        if len(self.buffers) >= self.batch_size:
+            self.flush()
+
+    def write_segments(self, segments):
+        """
+        Queue every fragment from an iterable.
+        """
+        for segment in segments:
+            self.write(segment)
+
+    def flush(self):
+        """
+        Write all queued fragments to the file descriptor.
+        """
+        buffers = self.buffers
+        self.buffers = []
+        if not hasattr(os, 'writev'):
+            # No scatter-gather I/O here (e.g. Windows).
+            data = memoryview(b''.join(buffers))
+            while data:
+                data = data[os.write(self.fd, data):]
+            return
+
+        while buffers:
+            written = os.writev(self.fd, buffers)
+
+            # The OS may accept fewer bytes than we offered. Drop the
+            # buffers that went out completely and trim the one that
+            # went out partially.
+            done = 0
+            while done < len(buffers) and written >= len(buffers[done]):
+                written -= len(buffers[done])
+                done += 1
+            buffers = buffers[done:]
+            if written:
+                buffers[0] = memoryview(buffers[0])[written:]
+
+    def close(self):
+        """
+        Flush queued fragments. The file descriptor is left open.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BufferSink(object):
+    """
+    Collects encoded fragments in memory, counting bytes the same way
+    SegmentWriter does.
+    """
+    accepts_bytes = True
+
+    def __init__(self, encoding: str = 'utf-8', position: int = 0):
+        self.encoding = encoding
+        self.buffers = []
+        self.position = position
+
+    def write(self, segment):
+        if isinstance(segment, str):
+            segment = segment.encode(self.encoding)
+        self.buffers.append(segment)
+        self.position += len(segment)
+
+    def write_segments(self, segments):
+        for segment in segments:
+            self.write(segment)
+
+
+class HashSink(object):
+    """
+    Computes a hash of the encoded fragments without writing them anywhere.
+
+    The hash is the same as the hash of the file SegmentWriter would write.
+    """
+    accepts_bytes = True
+
+    def __init__(self, encoding: str = 'utf-8', algorithm: str = 'sha256'):
+        self.encoding = encoding
+        self.hasher = hashlib.new(algorithm)
+        self.position = 0
+
+    def write(self, segment):
+        if isinstance(segment, str):
+            segment = segment.encode(self.encoding)
+        self.hasher.update(segment)
+        self.position += len(segment)
+
+    def write_segments(self, segments):
+        for segment in segments:
+            self.write(segment)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def document_hash(document: Document, encoding: str = 'utf-8') -> str:
+    """
+    Hash a document's rendered RTF as it is produced, without keeping it.
+
+    The hash only stays the same from one run to the next if the document's
+    creation time is fixed. See Information.
+    """
+    sink = HashSink(encoding)
+    sink.write_segments(document.segments(raw=True))
+    return sink.hexdigest()
+
+
+def write_if_changed(
+    document: Document,
+    path: str,
+    manifest: dict,
+    encoding: str = 'utf-8',
+    sync: bool = False
+) -> bool:
+    """
+    Write a document only if it differs from the last time it was written.
+
+    The document is first rendered into a HashSink. If the hash matches the
+    one recorded in *manifest* for *path* and the file is still there,
+    nothing is written. Otherwise the file is written and the manifest is
+    updated.
+
+    Args:
+        document (Document): The document to write.
+        path (str): Name of the file to create or replace.
+        manifest (dict): Hash of each file from the previous run, keyed by
+            path. Updated in place. See load_manifest() and save_manifest().
+        encoding (str): Encoding for the RTF text.
+        sync (bool): fsync() the file after writing it.
+
+    Returns:
+        (bool): True if the file was written, i.e. it needs to be uploaded.
+    """
+    digest = document_hash(document, encoding)
+    if manifest.get(path) == digest and os.path.exists(path):
+        return False
+    write_document(document, path, encoding, sync=sync)
+    manifest[path] = digest
+    return True
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Load the hashes saved by save_manifest(), or an empty manifest if there
+    aren't any yet.
+    """
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest: dict, manifest_path: str):
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def write_document(
+    document: Document,
+    path: str,
+    encoding: str = 'utf-8',
+    index_path: str = None,
+    sync: bool = False
+):
+    """
+    Write a document to a file using scatter-gather output.
+
+    Args:
+        document (Document): The document to write.
+        path (str): Name of the file to create or replace.
+        encoding (str): Encoding for the RTF text.
+        index_path (str): If given, also write a JSON index of the byte
+            offsets of the header, footer, each content section and each
+            table row to this file. See index_document().
+        sync (bool): fsync() the file after writing it.
+
+    Returns:
+        (int): Number of bytes written.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        with SegmentWriter(fd, encoding) as writer:
+            if index_path is None:
+                writer.write_segments(document.segments(raw=True))
+            else:
+                index = index_document(writer, document)
+        if sync:
+            os.fsync(fd)
+        if index_path is not None:
+            save_index(index, index_path)
+        return writer.position
+    finally:
+        os.close(fd)
+
+
+# Content sections rendered by render_body(), and the font, color and list
+# tables, as RTF, that their \\fN, \\cfN and \\lsN references refer to.
+RenderedBody = namedtuple('RenderedBody', ['data', 'tables'])
+
+
+def document_tables(document: Document) -> tuple:
+    return (
+        str(document.font_table),
+        str(document.color_table),
+        str(document.list_table),
+    )
+
+
+def render_body(document: Document, encoding: str = 'utf-8') -> RenderedBody:
+    """
+    Render just the content sections of a document.
+
+    For documents whose case-specific text is all in Fields (see
+    Document(use_fields=True) and CaseStyle(use_fields=True)), the body can
+    be rendered once and then written under the header of each case with
+    write_with_body(). A case style's layout still depends on the case
+    (see CaseStyle), so only cases that match in it can share a body.
+    """
+    sink = BufferSink(encoding)
+    for section in document.content_sections:
+        sink.write_segments(section_segments(section, raw=True))
+    return RenderedBody(b''.join(sink.buffers), document_tables(document))
+
+
+def write_with_body(
+    document: Document,
+    body: RenderedBody,
+    path: str,
+    encoding: str = 'utf-8'
+) -> int:
+    """
+    Write a document's header followed by a body from render_body().
+
+    Only the header (information block with the case's properties, footer,
+    etc.) is rendered. The body is written as-is, so *document* must have
+    the same font, color and list tables as the document the body was
+    rendered from, e.g. by sharing them:
+
+        case.font_table = source.font_table
+        case.color_table = source.color_table
+        case.list_table = source.list_table
+
+    Returns:
+        (int): Number of bytes written.
+
+    Raises:
+        ValueError: If the tables don't match.
+    """
+    if document_tables(document) != body.tables:
+        raise ValueError(
+            "The document's font, color or list table differs from the "
+            "one the body was rendered with"
+        )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        with SegmentWriter(fd, encoding) as writer:
+            writer.write_segments(document.header_segments())
+            writer.write(body.data)
+            writer.write('}')
+        return writer.position
+    finally:
+        os.close(fd)
+
+
+def _span(start: int, end: int) -> dict:
+    return {'offset': start, 'length': end - start}
+
+
+def index_document(sink, document: Document) -> dict:
+    """
+    Write a document to *sink*, recording where each part of it lands.
+
+    Args:
+        sink: A SegmentWriter or BufferSink.
+        document (Document): The document to write.
+
+    Returns:
+        (dict): Byte offsets and lengths, in the form:
+
+            {
+                'encoding': 'utf-8',
+                'header': {'offset': 0, 'length': 812},
+                'footer': {'offset': 501, 'length': 240},
+                'sections': [
+                    {'offset': 812, 'length': 97},
+                    {'offset': 909, 'length': 400, 'rows': [...]},
+                    ...
+                ],
+                'trailer': {'offset': 1309, 'length': 1},
+            }
+
+            'rows' is only present for Table sections and lists the span
+            of each row block, header row first.
+    """
+    index = {'encoding': sink.encoding}
+    start = sink.position
+    for name, rtf in document.header_parts():
+        if name == 'footer':
+            footer_start = sink.position
+            sink.write(rtf)
+            index['footer'] = _span(footer_start, sink.position)
+        else:
+            sink.write(rtf)
+    index['header'] = _span(start, sink.position)
+    index['sections'] = [
+        index_section(sink, section)
+        for section in document.content_sections
+    ]
+    start = sink.position
+    sink.write('}')
+    index['trailer'] = _span(start, sink.position)
+    return index
+
+
+def index_section(sink, section) -> dict:
+    """
+    Write one content section to *sink* and return its index entry.
+    """
+    start = sink.position
+    if isinstance(section, Table):
+        rows = []
+        begin = section.begin_row()
+        for fragment in section.segments():
+            row_start = sink.position
+            sink.write(fragment)
+            if fragment.startswith(begin):
+                rows.append(_span(row_start, sink.position))
+        entry = _span(start, sink.position)
+        entry['rows'] = rows
+        return entry
+    sink.write_segments(section_segments(section, raw=True))
+    return _span(start, sink.position)
+
+
+def save_index(index: dict, index_path: str):
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+
+
+def load_index(index_path: str) -> dict:
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def read_region(path: str, entry: dict) -> bytes:
+    """
+    Read the bytes for one index entry, e.g. to answer a range request.
+    """
+    with open(path, 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['length'])
+
+
+def _shift(entry: dict, delta: int):
+    entry['offset'] += delta
+    for row in entry.get('rows', []):
+        row['offset'] += delta
+
+
+def splice_section(path: str, index_path: str, number: int, section) -> dict:
+    """
+    Replace one content section of an RTF file written by write_document().
+
+    Only the new section is rendered. If it is the same size as the old
+    one it is written over the old bytes in place. Otherwise the file is
+    rebuilt by copying the bytes before and after the section around the
+    new RTF, without parsing or re-rendering them.
+
+    Args:
+        path (str): The RTF file.
+        index_path (str): Its index, which is updated to match.
+        number (int): Index into the document's content_sections.
+        section: The new content for that section.
+
+    Returns:
+        (dict): The updated index.
+    """
+    index = load_index(index_path)
+    old = index['sections'][number]
+    sink = BufferSink(index['encoding'], old['offset'])
+    new = index_section(sink, section)
+    delta = new['length'] - old['length']
+
+    if delta == 0:
+        with open(path, 'r+b') as f:
+            f.seek(old['offset'])
+            f.writelines(sink.buffers)
+    else:
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                remaining = old['offset']
+                while remaining:
+                    chunk = src.read(min(remaining, 1 << 20))
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+                dst.writelines(sink.buffers)
+                src.seek(old['offset'] + old['length'])
+                shutil.copyfileobj(src, dst)
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    index['sections'][number] = new
+    for entry in index['sections'][number + 1:]:
+        _shift(entry, delta)
+    _shift(index['trailer'], delta)
+    save_index(index, index_path)
+    return index
+
+
+def benchmark(paragraphs: int = 20000, rows: int = 20000, repeat: int = 3):
+    """
+    Compare join-then-write with SegmentWriter on a large document.
+    """
+    document = Document('Benchmark', '000-00000-2019', 'Benchmark')
+    for i in range(paragraphs):
+        p = Paragraph()
+        p.add_text(TextRun('Request No. %s' % i, TextRun.Properties(bold=True)))  # NOQA
+        p.add_text(TextRun('Produce all documents related to item %s.' % i))
+        document.add_content(p)
+    columns = [
+        Table.Column(width='30%', property=0, header='Bates'),
+        Table.Column(width='70%', property=1, header='Description'),
+    ]
+    data = [['DOE%06d' % i, 'Document number %s' % i] for i in range(rows)]
+    document.add_content(Table(columns, data))
+
+    def joined(path):
+        with open(path, 'wb') as f:
+            f.write(str(document).encode('utf-8'))
+
+    def scattered(path):
+        write_document(document, path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'benchmark.rtf')
+        for name, fn in (('join-then-write', joined), ('writev', scattered)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn(path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print('{:<16} {:8.3f}s  {:>12,} bytes'.format(
+                name, best, os.path.getsize(path)
+            ))
+
+
+if __name__ == '__main__':
+    benchmark()